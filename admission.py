@@ -0,0 +1,159 @@
+"""Admission control / load shedding for the request endpoints.
+A pure-ASGI middleware in front of selected routes:
+- per-client token buckets keyed on the client address -> fast 429
+- a load estimate from in-flight requests plus pluggable signals (dispatch queue
+  depth, DB pool usage) -> fast 503 once a priority class's threshold is crossed
+- priority classes: quotes are shed first, then service requests; accident tows
+  (the `service` / `service_type` field of the JSON body) are never shed, but still
+  go through a larger per-client bucket
+Shed responses carry Retry-After so clients back off instead of hammering.
+"""
+
+import json
+import math
+import time
+from collections import OrderedDict
+
+CRITICAL = "critical"
+REQUEST = "request"
+QUOTE = "quote"
+
+# shed a class once load reaches this fraction of capacity
+SHED_AT = {QUOTE: 0.7, REQUEST: 0.9}
+CRITICAL_SERVICE = "accident_tow"
+SERVICE_FIELDS = ("service", "service_type")
+CRITICAL_RATE_FACTOR = 4  # critical requests get this many times the normal bucket
+MAX_SNIFF_BYTES = 64 * 1024
+SHED_RETRY_AFTER = 2  # seconds
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now):
+        """Take one token; returns seconds to wait (0.0 if admitted)."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+class ClientBuckets:
+    """Token bucket per client key, LRU-bounded so idle clients don't accumulate."""
+
+    def __init__(self, rate=5.0, burst=20, max_clients=100000, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.clock = clock
+        self._buckets = OrderedDict()
+
+    def take(self, key):
+        now = self.clock()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket.take(now)
+
+def _client_key(scope):
+    # the peer address (the real client's when uvicorn runs with --proxy-headers);
+    # client-supplied ids are not trusted since rotating them would dodge the limit
+    client = scope.get("client")
+    return client[0] if client else "-"
+
+def _is_critical(body):
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return False
+    return isinstance(payload, dict) and any(payload.get(f) == CRITICAL_SERVICE for f in SERVICE_FIELDS)
+
+async def _send_json(send, status, body, retry_after):
+    payload = json.dumps(body).encode()
+    await send({"type": "http.response.start", "status": status, "headers": [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(payload)).encode()),
+        (b"retry-after", str(retry_after).encode()),
+    ]})
+    await send({"type": "http.response.body", "body": payload})
+
+class AdmissionMiddleware:
+    """
+    routes: {(method, path): QUOTE | REQUEST}; other routes pass straight through.
+    load_signals: callables returning current utilisation (1.0 == at capacity).
+    """
+
+    def __init__(self, app, routes, max_concurrency=64, load_signals=(), client_rate=5.0,
+                 client_burst=20, clock=time.monotonic):
+        self.app = app
+        self.routes = routes
+        self.max_concurrency = max_concurrency
+        self.load_signals = list(load_signals)
+        self.buckets = ClientBuckets(client_rate, client_burst, clock=clock)
+        self.critical_buckets = ClientBuckets(client_rate * CRITICAL_RATE_FACTOR,
+                                              client_burst * CRITICAL_RATE_FACTOR, clock=clock)
+        self.inflight = 0
+
+    def load(self):
+        load = self.inflight / self.max_concurrency
+        for signal in self.load_signals:
+            try:
+                load = max(load, signal())
+            except Exception:
+                continue  # a broken signal must not take the endpoint down
+        return load
+
+    async def _classify(self, scope, receive, cls):
+        """Upgrade to CRITICAL for accident tows; returns (class, receive to hand the app)."""
+        # sniff the (small JSON) body, then replay what was read to the app
+        buffered, size, more = [], 0, True
+        while more and size < MAX_SNIFF_BYTES:
+            message = await receive()
+            buffered.append(message)
+            if message["type"] != "http.request":
+                break
+            size += len(message.get("body", b""))
+            more = message.get("more_body", False)
+        body = b"".join(m.get("body", b"") for m in buffered)
+
+        async def replay():
+            if buffered:
+                return buffered.pop(0)
+            return await receive()
+
+        return (CRITICAL if _is_critical(body) else cls), replay
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        cls = self.routes.get((scope["method"], scope["path"]))
+        if cls is None:
+            return await self.app(scope, receive, send)
+        if cls != QUOTE:
+            cls, receive = await self._classify(scope, receive, cls)
+
+        if cls != CRITICAL and self.load() >= SHED_AT[cls]:
+            return await _send_json(send, 503, {"ok": False, "error": "overloaded",
+                                                "retry_after": SHED_RETRY_AFTER}, SHED_RETRY_AFTER)
+        buckets = self.critical_buckets if cls == CRITICAL else self.buckets
+        wait = buckets.take(_client_key(scope))
+        if wait > 0:
+            retry_after = max(1, math.ceil(wait))
+            return await _send_json(send, 429, {"ok": False, "error": "rate_limited",
+                                                "retry_after": retry_after}, retry_after)
+
+        self.inflight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.inflight -= 1
@@ -0,0 +1,77 @@
+"""Benchmark CPU cost of fanning one event out to many WebSocket clients.
+Compares the old per-socket `send_json` against encode-once `codec.Event` for text
+and binary clients. Sockets are in-process fakes that hand the frame to a no-op
+transport, so the numbers are serialization + dispatch overhead only.
+    python bench_broadcast.py [sockets] [events]
+"""
+
+import asyncio
+import json
+import sys
+import time
+import uuid
+
+import codec
+
+class FakeSocket:
+    """Mimics starlette's WebSocket send_* surface with a no-op transport."""
+
+    async def _send(self, message):
+        pass
+
+    async def send_json(self, data):
+        # what starlette does per call
+        await self._send({"type": "websocket.send", "text": json.dumps(data, separators=(",", ":"), ensure_ascii=False)})
+
+    async def send_text(self, data):
+        await self._send({"type": "websocket.send", "text": data})
+
+    async def send_bytes(self, data):
+        await self._send({"type": "websocket.send", "bytes": data})
+
+def job_opened():
+    rid = str(uuid.uuid4())
+    return {"type": "job_opened", "job": {"id": rid, "request_id": rid, "status": "open"},
+            "request": {"id": rid, "ts": time.time(), "status": "open", "service": "regular_tow",
+                        "pickup": [32.7767, -96.797], "drop": [32.9, -96.6], "miles": 11.42,
+                        "price": {"total": 127.1, "app_cut": 25.42, "provider": 101.68,
+                                  "details": {"base": 105, "free_miles": 7, "extra_miles": 4.42, "per_mile": 5}},
+                        "phone": "555-0100"}}
+
+def job_status():
+    return {"type": "job_status", "job_id": str(uuid.uuid4()), "status": "en_route"}
+
+async def per_socket_json(sockets, msg):
+    for s in sockets:
+        await s.send_json(msg)
+
+async def encode_once(sockets, msg, binary):
+    event = codec.Event(msg)
+    for s in sockets:
+        await codec.send(s, event, binary)
+
+def measure(label, n_sockets, n_events, make_msg, fn, *args):
+    sockets = [FakeSocket() for _ in range(n_sockets)]
+    msgs = [make_msg() for _ in range(n_events)]
+
+    async def run():
+        for m in msgs:
+            await fn(sockets, m, *args)
+
+    start = time.process_time()
+    asyncio.run(run())
+    per_event = (time.process_time() - start) / n_events
+    print(f"{label:<40} {per_event * 1e3:8.2f} ms CPU/event  {per_event / n_sockets * 1e9:8.0f} ns/socket")
+
+def main():
+    n_sockets = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    n_events = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    print(f"{n_sockets} sockets, {n_events} events each; orjson={codec.orjson is not None} "
+          f"msgpack={codec.msgpack is not None}")
+    for name, make in (("job_opened", job_opened), ("job_status", job_status)):
+        measure(f"{name}: send_json per socket", n_sockets, n_events, make, per_socket_json)
+        measure(f"{name}: encode once, text", n_sockets, n_events, make, encode_once, False)
+        measure(f"{name}: encode once, binary", n_sockets, n_events, make, encode_once, True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""Encode-once serialization for WebSocket events.
+An `Event` encodes its payload at most once per wire format, no matter how many
+sockets it is sent to. Text clients get JSON (orjson when installed); clients that
+negotiate the `roadguard.bin.v1` subprotocol get binary frames:
+
+    0x01 status    <B 16s B>    job uuid, status code (STATUS_CODES)
+    0x02 location  <B 16s i i>  provider/driver uuid, lat/lon in microdegrees
+    0x10 msgpack   0x10 + msgpack body (any other event)
+    0x11 json      0x11 + UTF-8 JSON body (any other event, msgpack not installed)
+
+Integers are little-endian; a location frame is 25 bytes instead of ~90 of JSON.
+No web framework imports so the benchmark and simulator can use it directly.
+"""
+
+import json
+import math
+import struct
+import uuid
+from enum import Enum
+
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional; binary clients fall back to JSON-in-frame
+    msgpack = None
+
+BINARY_SUBPROTOCOL = "roadguard.bin.v1"
+
+FRAME_STATUS = 0x01
+FRAME_LOCATION = 0x02
+FRAME_MSGPACK = 0x10
+FRAME_JSON = 0x11
+
+STATUS_CODES = ["open", "requested", "assigned", "en_route", "arrived", "in_progress",
+                "completed", "cancelled", "unserviced"]
+_STATUS_INDEX = {s: i for i, s in enumerate(STATUS_CODES)}
+
+_STATUS = struct.Struct("<B16sB")
+_LOCATION = struct.Struct("<B16sii")
+_MAX_LAT = 90_000_000  # microdegrees
+_MAX_LON = 180_000_000
+
+def _default(o):
+    # enums that aren't str subclasses, Decimal, UUID
+    if isinstance(o, Enum):
+        return o.value
+    return str(o)
+
+def dumps(msg) -> str:
+    if orjson is not None:
+        return orjson.dumps(msg, default=_default).decode()
+    return json.dumps(msg, separators=(",", ":"), ensure_ascii=False, default=_default)
+
+def _uuid_bytes(value):
+    try:
+        return uuid.UUID(str(value)).bytes
+    except (ValueError, TypeError):
+        return None
+
+def pack_status(job_id, status):
+    code = _STATUS_INDEX.get(status)
+    raw = _uuid_bytes(job_id)
+    if code is None or raw is None:
+        return None
+    return _STATUS.pack(FRAME_STATUS, raw, code)
+
+def pack_location(entity_id, lat, lon):
+    raw = _uuid_bytes(entity_id)
+    if raw is None or lat is None or lon is None or not (math.isfinite(lat) and math.isfinite(lon)):
+        return None
+    lat_u, lon_u = round(lat * 1e6), round(lon * 1e6)
+    if abs(lat_u) > _MAX_LAT or abs(lon_u) > _MAX_LON:
+        return None  # not a coordinate; falls back to the generic msgpack/json frame
+    return _LOCATION.pack(FRAME_LOCATION, raw, lat_u, lon_u)
+
+def unpack(frame: bytes):
+    """Decode a binary frame back into an event dict; raises ValueError if it is malformed."""
+    if not frame:
+        raise ValueError("empty frame")
+    kind = frame[0]
+    if kind == FRAME_STATUS:
+        if len(frame) != _STATUS.size:
+            raise ValueError(f"status frame must be {_STATUS.size} bytes")
+        _, raw, code = _STATUS.unpack(frame)
+        if code >= len(STATUS_CODES):
+            raise ValueError(f"unknown status code {code}")
+        return {"type": "job_status", "job_id": str(uuid.UUID(bytes=raw)), "status": STATUS_CODES[code]}
+    if kind == FRAME_LOCATION:
+        if len(frame) != _LOCATION.size:
+            raise ValueError(f"location frame must be {_LOCATION.size} bytes")
+        _, raw, lat, lon = _LOCATION.unpack(frame)
+        return {"type": "location", "id": str(uuid.UUID(bytes=raw)), "lat": lat / 1e6, "lon": lon / 1e6}
+    if kind == FRAME_MSGPACK and msgpack is not None:
+        return msgpack.unpackb(frame[1:])
+    if kind == FRAME_JSON:
+        return json.loads(frame[1:])
+    raise ValueError(f"unknown frame type {kind:#x}")
+
+class Event:
+    """A message plus its lazily computed, cached wire encodings."""
+    __slots__ = ("msg", "_text", "_binary")
+
+    def __init__(self, msg: dict):
+        self.msg = msg
+        self._text = None
+        self._binary = None
+
+    def text(self) -> str:
+        if self._text is None:
+            self._text = dumps(self.msg)
+        return self._text
+
+    def binary(self) -> bytes:
+        if self._binary is None:
+            self._binary = self._encode_binary()
+        return self._binary
+
+    def _encode_binary(self):
+        msg = self.msg
+        kind = msg.get("type")
+        frame = None
+        if kind == "job_status":
+            frame = pack_status(msg.get("job_id"), msg.get("status"))
+        elif kind == "location":
+            frame = pack_location(msg.get("id"), msg.get("lat"), msg.get("lon"))
+        if frame is not None:
+            return frame
+        if msgpack is not None:
+            return bytes([FRAME_MSGPACK]) + msgpack.packb(msg, default=_default)
+        return bytes([FRAME_JSON]) + self.text().encode()
+
+async def send(ws, event: Event, binary: bool = False):
+    if binary:
+        await ws.send_bytes(event.binary())
+    else:
+        await ws.send_text(event.text())
+
+def negotiate(ws):
+    """Pick the binary subprotocol if the client offered it; returns (subprotocol, binary)."""
+    offered = ws.scope.get("subprotocols") or []
+    if BINARY_SUBPROTOCOL in offered:
+        return BINARY_SUBPROTOCOL, True
+    return None, False
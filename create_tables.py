@@ -1,10 +1,34 @@
 # Simple helper to create DB tables using SQLAlchemy models
+from sqlalchemy import text
+
 from .db import engine
 from .models import Base
 
+# create_all never alters existing tables; columns and indexes added to models after a
+# database was first created are brought in here (idempotent, safe to run on every start)
+UPGRADES = [
+    "ALTER TABLE drivers ADD COLUMN IF NOT EXISTS rating_count INTEGER DEFAULT 0",
+    "ALTER TABLE drivers ADD COLUMN IF NOT EXISTS rating_sum INTEGER DEFAULT 0",
+    "ALTER TABLE drivers ADD COLUMN IF NOT EXISTS rating_recent FLOAT DEFAULT 5.0",
+    "ALTER TABLE drivers ADD COLUMN IF NOT EXISTS last_assigned_at TIMESTAMP",
+    "ALTER TABLE drivers ADD COLUMN IF NOT EXISTS last_heartbeat_at TIMESTAMP",
+    "ALTER TABLE jobs ADD COLUMN IF NOT EXISTS created_at TIMESTAMP",
+    "CREATE INDEX IF NOT EXISTS ix_jobs_created_at ON jobs (created_at)",
+    # fails if a job already has several ratings; delete the extras first
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_ratings_job_id ON ratings (job_id)",
+    # likewise needs duplicate wallets merged first
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_driver_wallets_driver_id ON driver_wallets (driver_id)",
+]
+
+def upgrade_columns(bind=engine):
+    with bind.begin() as conn:
+        for stmt in UPGRADES:
+            conn.execute(text(stmt))
+
 def create_all():
     print("Creating DB tables...")
     Base.metadata.create_all(bind=engine)
+    upgrade_columns()
     print("Done.")
 
 if __name__ == "__main__":
@@ -2,13 +2,42 @@
 This file implements a simple function `start_dispatch_worker(job_id, lat, lon, service_type)`
 which simulates searching for eligible drivers and assigns the first available match.
 It is intended as a developer-friendly prototype and uses DB queries via SQLAlchemy.
+The matching rules (`select_candidates`, `radius_schedule`) are DB-free so the
+dispatch simulator (simulator.py) can replay them against a virtual clock.
 """
 
-from .db import SessionLocal
 from . import models
+from .ratings import effective_rating
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 import math
+import os
+import threading
 import time
 
+# ranking weights (lower score is better); distance is normalised to the search radius,
+# rating to the 1-5 star range and idle time is capped at IDLE_CAP_MINUTES
+RANK_WEIGHT_DISTANCE = 0.6
+RANK_WEIGHT_RATING = 0.25
+RANK_WEIGHT_IDLE = 0.15
+IDLE_CAP_MINUTES = 60.0
+
+# radius-expansion policy
+INITIAL_RADIUS_MILES = 3.0
+RADIUS_GROWTH = 2.0
+MAX_ATTEMPTS = 4
+BACKOFF_SECONDS = 1.0
+
+# capability rules: these vehicles are roadside-only
+TOW_SERVICES = frozenset(["regular_tow", "accident_tow", "motorcycle_tow"])
+NO_TOW_VEHICLES = frozenset(["service_truck"])
+
+# bounded worker pools so bulk imports don't spawn one blocking dispatch per request thread;
+# bulk rows get their own pool so an import never delays (or sheds) interactive requests
+DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", "8"))
+BULK_DISPATCH_WORKERS = int(os.getenv("BULK_DISPATCH_WORKERS", "4"))
+BULK_QUEUE_MAX = 1000  # queued bulk dispatches before ingest stops reading the upload
+
 def haversine_miles(lat1, lon1, lat2, lon2):
     # Haversine formula to estimate distance in miles between two lat/lon pairs
     R = 3958.8  # Earth radius in miles
@@ -21,14 +50,37 @@ def haversine_miles(lat1, lon1, lat2, lon2):
     c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
     return R * c
 
-def find_eligible_drivers(db, lat, lon, service_type, radius_miles):
+def rank_score(driver, dist, radius_miles, now=None):
     """
-    Service rules:
-    - flatbed & wheel_lift: can do all jobs
-    - service_truck: roadside-only (no tows)
+    Blend distance, rating and idle time into one score (lower ranks first).
+    Uses only columns already loaded on the driver row, so ranking adds no queries.
+    """
+    now = now or datetime.utcnow()
+    dist_term = dist / radius_miles if radius_miles > 0 else 0.0
+    rating_term = (effective_rating(driver) - 1.0) / 4.0
+    if driver.last_assigned_at is None:
+        idle_term = 1.0
+    else:
+        idle_minutes = (now - driver.last_assigned_at).total_seconds() / 60.0
+        idle_term = min(max(idle_minutes, 0.0) / IDLE_CAP_MINUTES, 1.0)
+    return (RANK_WEIGHT_DISTANCE * dist_term
+            - RANK_WEIGHT_RATING * rating_term
+            - RANK_WEIGHT_IDLE * idle_term)
+
+def radius_schedule(initial_radius=INITIAL_RADIUS_MILES, growth=RADIUS_GROWTH, max_attempts=MAX_ATTEMPTS):
+    """Search radius for each dispatch attempt, e.g. [3, 6, 12, 24] miles."""
+    return [initial_radius * growth ** i for i in range(max_attempts)]
+
+def is_capable(vehicle_type, service_type, no_tow_vehicles=NO_TOW_VEHICLES):
+    return not (vehicle_type in no_tow_vehicles and service_type in TOW_SERVICES)
+
+def select_candidates(drivers, vehicle_for, lat, lon, service_type, radius_miles, now,
+                      no_tow_vehicles=NO_TOW_VEHICLES):
+    """
+    Filter and rank online drivers for a job; `vehicle_for(driver)` returns the
+    driver's primary vehicle (or None). Returns [(driver, vehicle, dist)] best-first.
     """
     candidates = []
-    drivers = db.query(models.Driver).filter(models.Driver.is_online == True).all()
     for d in drivers:
         # compute distance
         if d.current_lat is None or d.current_lon is None:
@@ -36,23 +88,38 @@ def find_eligible_drivers(db, lat, lon, service_type, radius_miles):
         dist = haversine_miles(lat, lon, d.current_lat, d.current_lon)
         if dist > radius_miles:
             continue
-        # check vehicle capability: get primary vehicle for driver (first registered)
-        veh = db.query(models.Vehicle).filter(models.Vehicle.driver_id == d.id).first()
+        veh = vehicle_for(d)
         if not veh:
             continue
-        if veh.type == "service_truck" and service_type in ["regular_tow", "accident_tow", "motorcycle_tow"]:
-            # service truck cannot do tows
+        if not is_capable(veh.type, service_type, no_tow_vehicles):
             continue
         candidates.append((d, veh, dist))
-    # sort by distance ascending
-    candidates.sort(key=lambda t: t[2])
+    # rank by blended distance / rating / idle-time score
+    candidates.sort(key=lambda t: rank_score(t[0], t[2], radius_miles, now))
     return candidates
 
+def find_eligible_drivers(db, lat, lon, service_type, radius_miles):
+    """
+    Service rules:
+    - flatbed & wheel_lift: can do all jobs
+    - service_truck: roadside-only (no tows)
+    Candidates are returned best-first by `rank_score`.
+    """
+    drivers = db.query(models.Driver).filter(models.Driver.is_online == True).all()
+
+    def vehicle_for(d):
+        # primary vehicle for driver (first registered)
+        return db.query(models.Vehicle).filter(models.Vehicle.driver_id == d.id).first()
+
+    return select_candidates(drivers, vehicle_for, lat, lon, service_type, radius_miles, datetime.utcnow())
+
 def assign_job_to_driver(db, job, driver, vehicle):
     job.driver_id = driver.id
     job.vehicle_id = vehicle.id
     job.status = "assigned"
+    driver.last_assigned_at = datetime.utcnow()
     db.add(job)
+    db.add(driver)
     db.commit()
     print(f"Assigned job {job.id} to driver {driver.id} (vehicle {vehicle.id})")
 
@@ -61,17 +128,15 @@ def start_dispatch_worker(job_id: str, lat: float, lon: float, service_type: str
     Simple synchronous radius-expansion dispatcher.
     In production this should be event-driven and async.
     """
+    from .db import SessionLocal  # imported lazily so the simulator runs without a DB driver
     db = SessionLocal()
     job = db.query(models.Job).filter(models.Job.id == job_id).first()
     if not job:
         print("Job not found:", job_id)
         return False
 
-    radius = 3.0  # miles initial radius
-    attempts = 0
-    max_attempts = 4
-    while attempts < max_attempts:
-        print(f"Dispatch attempt {attempts+1} radius={radius} miles for job {job_id}")
+    for attempt, radius in enumerate(radius_schedule()):
+        print(f"Dispatch attempt {attempt+1} radius={radius} miles for job {job_id}")
         candidates = find_eligible_drivers(db, lat, lon, service_type, radius)
         if candidates:
             # Offer to first candidate (synchronous accept simulation)
@@ -80,9 +145,7 @@ def start_dispatch_worker(job_id: str, lat: float, lon: float, service_type: str
             db.close()
             return True
         # expand radius and retry
-        radius *= 2
-        attempts += 1
-        time.sleep(1)  # backoff in this prototype
+        time.sleep(BACKOFF_SECONDS)  # backoff in this prototype
     # no drivers found
     job.status = "unserviced"
     db.add(job)
@@ -90,3 +153,49 @@ def start_dispatch_worker(job_id: str, lat: float, lon: float, service_type: str
     db.close()
     print(f"No drivers found for job {job_id}")
     return False
+
+class DispatchPool:
+    """Thread pool that tracks how many jobs are queued or running."""
+
+    def __init__(self, workers, name):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._pending = 0
+        self._cond = threading.Condition()
+
+    def _run(self, job_id, lat, lon, service_type):
+        try:
+            start_dispatch_worker(job_id, lat, lon, service_type)
+        except Exception as e:
+            print(f"Dispatch failed for job {job_id}: {e}")
+        finally:
+            with self._cond:
+                self._pending -= 1
+                self._cond.notify_all()
+
+    def submit(self, job_id, lat, lon, service_type):
+        with self._cond:
+            self._pending += 1
+        self._executor.submit(self._run, job_id, lat, lon, service_type)
+
+    def depth(self):
+        return self._pending
+
+    def wait_below(self, limit, timeout=None):
+        """Block until fewer than `limit` jobs are queued; returns False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pending < limit, timeout)
+
+_interactive = DispatchPool(DISPATCH_WORKERS, "dispatch")
+_bulk = DispatchPool(BULK_DISPATCH_WORKERS, "dispatch-bulk")
+
+def enqueue_dispatch(job_id: str, lat: float, lon: float, service_type: str, bulk: bool = False):
+    """Queue a job for the dispatch worker pool and return immediately."""
+    (_bulk if bulk else _interactive).submit(job_id, lat, lon, service_type)
+
+def queue_depth(bulk: bool = False):
+    """Number of jobs queued or currently being dispatched."""
+    return (_bulk if bulk else _interactive).depth()
+
+def wait_for_bulk_capacity(limit=BULK_QUEUE_MAX, timeout=None):
+    """Backpressure for bulk ingest: block until the bulk queue drains below `limit`."""
+    return _bulk.wait_below(limit, timeout)
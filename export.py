@@ -0,0 +1,93 @@
+"""Streaming export of job history for ops / finance reconciliation.
+Rows are read through a server-side cursor (`yield_per`) and encoded in small
+batches, so the first bytes go out immediately and memory stays constant no
+matter how many jobs match.
+"""
+
+import csv
+import io
+import json
+
+from .db import SessionLocal
+from . import models
+from .pricing import payout_split
+
+BATCH_SIZE = 1000
+
+COLUMNS = [
+    "job_id", "created_at", "status", "service_type", "user_id",
+    "driver_id", "driver_name", "driver_rating",
+    "pickup_lat", "pickup_lon", "dropoff_lat", "dropoff_lon", "distance_miles",
+    "base_price", "extra_charges", "total_amount", "platform_cut", "provider",
+]
+
+def _fmt(v):
+    if v is None:
+        return None
+    if isinstance(v, (str, int, float, bool)):
+        return v
+    if hasattr(v, "isoformat"):
+        return v.isoformat()
+    return str(v)  # Decimal / UUID
+
+def iter_jobs(start=None, end=None, status=None, service_type=None, batch_size=BATCH_SIZE):
+    """Yield one flat dict per job (jobs LEFT JOIN drivers, price split from pricing)."""
+    db = SessionLocal()
+    try:
+        q = (db.query(models.Job, models.Driver.display_name, models.Driver.rating)
+             .outerjoin(models.Driver, models.Driver.id == models.Job.driver_id))
+        if start is not None:
+            q = q.filter(models.Job.created_at >= start)
+        if end is not None:
+            q = q.filter(models.Job.created_at < end)
+        if status:
+            q = q.filter(models.Job.status == status)
+        if service_type:
+            q = q.filter(models.Job.service_type == service_type)
+        q = q.order_by(models.Job.created_at).yield_per(batch_size)
+        for job, driver_name, driver_rating in q:
+            split = payout_split(job.total_amount) if job.total_amount is not None else {}
+            yield {
+                "job_id": job.id, "created_at": job.created_at, "status": job.status,
+                "service_type": job.service_type, "user_id": job.user_id,
+                "driver_id": job.driver_id, "driver_name": driver_name,
+                "driver_rating": driver_rating,
+                "pickup_lat": job.pickup_lat, "pickup_lon": job.pickup_lon,
+                "dropoff_lat": job.dropoff_lat, "dropoff_lon": job.dropoff_lon,
+                "distance_miles": job.distance_miles, "base_price": job.base_price,
+                "extra_charges": job.extra_charges, "total_amount": job.total_amount,
+                "platform_cut": split.get("platform_cut"), "provider": split.get("provider"),
+            }
+            # rows are only needed for the line being encoded
+            db.expunge(job)
+    finally:
+        db.close()
+
+def ndjson_chunks(rows, batch_size=BATCH_SIZE):
+    buf = []
+    for row in rows:
+        buf.append(json.dumps({k: _fmt(v) for k, v in row.items()}))
+        if len(buf) >= batch_size:
+            yield "\n".join(buf) + "\n"
+            buf = []
+    if buf:
+        yield "\n".join(buf) + "\n"
+
+def csv_chunks(rows, batch_size=BATCH_SIZE):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(COLUMNS)
+    yield out.getvalue()  # header goes out before the first row is fetched
+    out.seek(0)
+    out.truncate()
+    n = 0
+    for row in rows:
+        writer.writerow(["" if row[c] is None else _fmt(row[c]) for c in COLUMNS])
+        n += 1
+        if n >= batch_size:
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+            n = 0
+    if n:
+        yield out.getvalue()
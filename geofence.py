@@ -0,0 +1,171 @@
+"""Service-area geofence for request admission.
+Service areas (and partner zones) are polygons in a local GeoJSON file. They are
+indexed on a lat/lon grid: each grid cell lists the polygons whose bounding box
+touches it, and each polygon keeps its edges bucketed by grid row. A lookup is a
+dict hit plus an even-odd ray cast over the few edges in the point's row, a few
+microseconds per request, with no DB access.
+
+Feature properties:
+    name     area name
+    kind     "service" (default) or "partner"
+    partner  partner id for partner zones
+
+The file is re-read when its mtime changes (checked at most every RELOAD_CHECK_SECONDS),
+so areas can be edited without a restart. With no file, every request is admitted.
+"""
+
+import json
+import math
+import os
+import threading
+import time
+
+CELL_DEGREES = 0.1
+RELOAD_CHECK_SECONDS = 2.0
+DEFAULT_PATH = os.getenv("SERVICE_AREAS_PATH",
+                         os.path.join(os.path.dirname(os.path.abspath(__file__)), "service_areas.geojson"))
+
+ADMIT = "admit"
+PARTNER = "partner"
+REJECT = "reject"
+
+def _cell(v):
+    return math.floor(v / CELL_DEGREES)
+
+class Area:
+    __slots__ = ("name", "kind", "partner", "bbox", "rows")
+
+    def __init__(self, name, kind, partner, rings):
+        self.name = name
+        self.kind = kind
+        self.partner = partner
+        lats = [lat for ring in rings for _, lat in ring]
+        lons = [lon for ring in rings for lon, _ in ring]
+        self.bbox = (min(lats), min(lons), max(lats), max(lons))
+        # edges (lat1, lon1, lat2, lon2) bucketed by every grid row they span
+        self.rows = {}
+        for ring in rings:
+            for (lon1, lat1), (lon2, lat2) in zip(ring, ring[1:] + ring[:1]):
+                if lat1 == lat2:
+                    continue  # horizontal edges never cross the ray
+                for row in range(_cell(min(lat1, lat2)), _cell(max(lat1, lat2)) + 1):
+                    self.rows.setdefault(row, []).append((lat1, lon1, lat2, lon2))
+
+    @property
+    def partner_id(self):
+        """Who a partner-zone request is referred to; falls back to the area name."""
+        return self.partner or self.name or "partner"
+
+    def contains(self, lat, lon):
+        if not (self.bbox[0] <= lat <= self.bbox[2] and self.bbox[1] <= lon <= self.bbox[3]):
+            return False
+        inside = False
+        for lat1, lon1, lat2, lon2 in self.rows.get(_cell(lat), ()):
+            if (lat1 > lat) != (lat2 > lat):
+                if lon < lon1 + (lat - lat1) * (lon2 - lon1) / (lat2 - lat1):
+                    inside = not inside
+        return inside
+
+class AreaIndex:
+    def __init__(self, areas):
+        self.areas = areas
+        self.cells = {}
+        for i, area in enumerate(areas):
+            min_lat, min_lon, max_lat, max_lon = area.bbox
+            for row in range(_cell(min_lat), _cell(max_lat) + 1):
+                for col in range(_cell(min_lon), _cell(max_lon) + 1):
+                    self.cells.setdefault((row, col), []).append(i)
+
+    def lookup(self, lat, lon):
+        """Matching area, preferring service areas over partner zones."""
+        partner = None
+        for i in self.cells.get((_cell(lat), _cell(lon)), ()):
+            area = self.areas[i]
+            if area.contains(lat, lon):
+                if area.kind != PARTNER:
+                    return area
+                partner = partner or area
+        return partner
+
+def parse_geojson(doc):
+    features = doc.get("features", []) if doc.get("type") == "FeatureCollection" else [doc]
+    areas = []
+    for f in features:
+        geom = f.get("geometry") or {}
+        props = f.get("properties") or {}
+        if geom.get("type") == "Polygon":
+            polygons = [geom["coordinates"]]
+        elif geom.get("type") == "MultiPolygon":
+            polygons = geom["coordinates"]
+        else:
+            continue
+        kind = PARTNER if props.get("kind") == PARTNER else "service"
+        for rings in polygons:
+            # GeoJSON rings are [lon, lat] points with the first point repeated at the end
+            rings = [[(p[0], p[1]) for p in (ring[:-1] if ring[0] == ring[-1] else ring)]
+                     for ring in rings if len(ring) >= 3]
+            if rings:
+                areas.append(Area(props.get("name"), kind, props.get("partner"), rings))
+    return AreaIndex(areas)
+
+class ServiceAreas:
+    """Hot-reloadable geofence; `check(lat, lon)` returns (ADMIT | PARTNER | REJECT, area)."""
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self._index = None
+        self._mtime = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self._maybe_reload()
+
+    @property
+    def enabled(self):
+        return self._index is not None
+
+    def reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            self._index, self._mtime = None, None
+            return False
+        with open(self.path) as f:
+            index = parse_geojson(json.load(f))
+        self._index, self._mtime = index, mtime  # readers only ever see a complete index
+        return True
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now < self._next_check or not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._next_check = now + RELOAD_CHECK_SECONDS
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                mtime = None
+            if mtime != self._mtime:
+                try:
+                    self.reload()
+                except OSError as e:
+                    # replaced/removed between stat and open: keep the previous areas and
+                    # leave the mtime alone so the next check tries again
+                    print("Service area reload failed:", e)
+                except (ValueError, KeyError, TypeError, IndexError) as e:
+                    # keep serving the previous areas if the new file is malformed
+                    self._mtime = mtime
+                    print("Service area reload failed:", e)
+        finally:
+            self._lock.release()
+
+    def check(self, lat, lon):
+        self._maybe_reload()
+        index = self._index
+        if index is None:
+            return ADMIT, None
+        area = index.lookup(lat, lon)
+        if area is None:
+            return REJECT, None
+        return (PARTNER if area.kind == PARTNER else ADMIT), area
+
+service_areas = ServiceAreas()
@@ -0,0 +1,96 @@
+"""Idempotency-Key support for job creation.
+`IdempotencyCache` is a bounded in-process TTL cache of responses keyed by the
+client's Idempotency-Key. A retry with the same key gets the original response.
+A duplicate that arrives while the first request is still running blocks until
+the first finishes and then shares its result, so only one job is created and
+dispatched. A key reused with a different request body is rejected.
+The SQLAlchemy path (main.py) backs this with the `idempotency_keys` table so keys
+survive restarts and are shared between worker processes.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_TTL = 24 * 3600  # seconds
+DEFAULT_MAX_KEYS = 100000
+IN_FLIGHT_WAIT = 30.0  # seconds a duplicate waits for the original request
+IN_FLIGHT_LEASE = 60.0  # seconds before an unfinished claim (crashed worker) can be re-claimed
+
+class KeyReused(Exception):
+    """The key was already used with a different request payload."""
+
+class InFlight(Exception):
+    """The original request for this key did not finish (failed or timed out)."""
+
+def fingerprint(payload) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+class _Entry:
+    __slots__ = ("fingerprint", "expires", "done", "value", "event")
+
+    def __init__(self, fingerprint, expires):
+        self.fingerprint = fingerprint
+        self.expires = expires
+        self.done = False
+        self.value = None
+        self.event = threading.Event()
+
+class IdempotencyCache:
+    def __init__(self, ttl=DEFAULT_TTL, max_keys=DEFAULT_MAX_KEYS, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.clock = clock
+        self._entries = OrderedDict()  # insertion order == expiry order (fixed TTL)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self, now):
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.expires > now and len(self._entries) <= self.max_keys:
+                break
+            del self._entries[key]
+
+    def run(self, key, fp, fn, store=lambda value: True):
+        """
+        Return (value, replayed). Runs fn() at most once per live key; concurrent and
+        later duplicates get the first call's value. Values rejected by `store` are
+        not cached (the next retry runs fn again).
+        """
+        now = self.clock()
+        with self._lock:
+            self._evict(now)
+            entry = self._entries.get(key)
+            owner = entry is None
+            if owner:
+                entry = self._entries[key] = _Entry(fp, now + self.ttl)
+        if not owner:
+            if entry.fingerprint != fp:
+                raise KeyReused(key)
+            if not entry.event.wait(IN_FLIGHT_WAIT) or not entry.done:
+                raise InFlight(key)
+            return entry.value, True
+
+        try:
+            value = fn()
+        except BaseException:
+            self._release(key, entry)
+            raise
+        if not store(value):
+            entry.value, entry.done = value, True  # in-flight duplicates still share it
+            self._release(key, entry)
+            return value, False
+        entry.value, entry.done = value, True
+        entry.event.set()
+        return value, False
+
+    def _release(self, key, entry):
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+        entry.event.set()
@@ -0,0 +1,202 @@
+"""Streaming bulk ingest of service calls from fleet / motor-club partners.
+The request body (NDJSON or CSV) is read incrementally, rows are validated one at a
+time, inserted in chunked multi-row INSERTs and queued for dispatch, and a per-row
+result line is streamed back after each chunk commits. Only one chunk of rows is held
+in memory at a time, and reading pauses while the bulk dispatch queue is full, so
+memory stays flat regardless of upload size.
+"""
+
+import codecs
+import csv
+import json
+import uuid
+
+from pydantic import ValidationError
+from sqlalchemy.dialects.postgresql import UUID
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse
+
+from .db import SessionLocal
+from . import models
+from . import geofence
+from .dispatch import enqueue_dispatch, wait_for_bulk_capacity
+
+CHUNK_SIZE = 500
+MAX_LINE_BYTES = 64 * 1024
+# job columns the DB types as UUID; row values for these are checked before insert
+UUID_COLUMNS = [c.name for c in models.Job.__table__.columns if isinstance(c.type, UUID)]
+
+async def iter_lines(chunks):
+    """Yield decoded text lines from an async iterator of byte chunks."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    async for chunk in chunks:
+        buf += decoder.decode(chunk)
+        *lines, buf = buf.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+        if len(buf) > MAX_LINE_BYTES:
+            raise ValueError("line too long")
+    buf += decoder.decode(b"", final=True)
+    if buf:
+        yield buf.rstrip("\r")
+
+async def iter_csv_rows(lines):
+    """
+    Yield parsed CSV records (or the csv.Error for an unparsable one) from text lines.
+    A quoted field may span lines (RFC 4180), so lines are collected until their quotes
+    balance and then parsed as one record.
+    """
+    pending, size, quotes = [], 0, 0
+    async for line in lines:
+        if not pending and not line.strip():
+            continue
+        pending.append(line + "\n")
+        size += len(line)
+        quotes += line.count('"')
+        if quotes % 2:
+            if size > MAX_LINE_BYTES:
+                raise ValueError("unterminated quoted field")
+            continue
+        try:
+            yield next(csv.reader(pending))
+        except csv.Error as e:
+            yield e
+        pending, size, quotes = [], 0, 0
+    if pending:
+        raise ValueError("unterminated quoted field")
+
+async def iter_records(chunks, fmt):
+    """Yield (row_number, dict) pairs, or (row_number, error string) for unparsable rows."""
+    row_no = 0
+    if fmt == "csv":
+        header = None
+        async for values in iter_csv_rows(iter_lines(chunks)):
+            if header is None:
+                if isinstance(values, csv.Error):
+                    raise ValueError(f"bad header: {values}")
+                header = [h.strip() for h in values]
+                continue
+            row_no += 1
+            if isinstance(values, csv.Error):
+                yield row_no, f"parse error: {values}"
+                continue
+            yield row_no, {k: (v if v != "" else None) for k, v in zip(header, values)}
+        return
+    async for line in iter_lines(chunks):
+        if not line.strip():
+            continue
+        row_no += 1
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("row must be a JSON object")
+        except ValueError as e:
+            yield row_no, f"parse error: {e}"
+            continue
+        yield row_no, record
+
+class IngestResponse(StreamingResponse):
+    """
+    StreamingResponse whose body iterator reads the request body itself.
+    The stock response listens for disconnects on `receive` while streaming, which
+    would steal body chunks from the upload, so stream without that listener.
+    """
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+def _result(row_no, ok, **fields):
+    return json.dumps({"row": row_no, "ok": ok, **fields}) + "\n"
+
+def _column_errors(req):
+    errors = []
+    for name in UUID_COLUMNS:
+        value = getattr(req, name, None)
+        if value is None:
+            continue
+        try:
+            uuid.UUID(str(value))
+        except ValueError:
+            errors.append({"loc": [name], "msg": "Input should be a valid UUID"})
+    return errors
+
+def _insert_rows(db, rows):
+    try:
+        db.execute(models.Job.__table__.insert(), rows)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        return e
+    return None
+
+def _insert_chunk(batch):
+    """Insert a chunk of validated, admitted rows, queue their dispatch and return the result lines."""
+    rows = [{
+        "id": models.gen_uuid(),
+        "user_id": req.user_id,
+        "service_type": req.service_type,
+        "status": "referred" if partner else "requested",
+        "pickup_lat": req.pickup_lat,
+        "pickup_lon": req.pickup_lon,
+        "dropoff_lat": req.dropoff_lat,
+        "dropoff_lon": req.dropoff_lon,
+    } for _, req, partner in batch]
+    errors = [None] * len(rows)
+    db = SessionLocal()
+    try:
+        if _insert_rows(db, rows) is not None:
+            # a value the DB rejects (e.g. a user_id that isn't a UUID) fails the whole
+            # statement; retry row by row so only the offending rows are reported
+            errors = [_insert_rows(db, [row]) for row in rows]
+    finally:
+        db.close()
+    out = []
+    for (row_no, req, partner), row, error in zip(batch, rows, errors):
+        if error is not None:
+            out.append(_result(row_no, False, error=f"insert failed: {error.__class__.__name__}"))
+        elif partner:
+            out.append(_result(row_no, True, job_id=row["id"], status="referred", partner=partner))
+        else:
+            enqueue_dispatch(row["id"], req.pickup_lat, req.pickup_lon, req.service_type, bulk=True)
+            out.append(_result(row_no, True, job_id=row["id"], status="requested"))
+    return "".join(out)
+
+async def ingest_stream(chunks, fmt, row_model, chunk_size=CHUNK_SIZE):
+    """Async generator of NDJSON result lines for a streamed upload."""
+    batch = []
+    try:
+        async for row_no, record in iter_records(chunks, fmt):
+            if isinstance(record, str):
+                yield _result(row_no, False, error=record)
+                continue
+            try:
+                req = row_model(**record)
+            except ValidationError as e:
+                yield _result(row_no, False, error=[
+                    {"loc": list(err["loc"]), "msg": err["msg"]} for err in e.errors()])
+                continue
+            errors = _column_errors(req)
+            if errors:
+                yield _result(row_no, False, error=errors)
+                continue
+            verdict, area = geofence.service_areas.check(req.pickup_lat, req.pickup_lon)
+            if verdict == geofence.REJECT:
+                yield _result(row_no, False, error="out_of_service_area")
+                continue
+            partner = area.partner_id if verdict == geofence.PARTNER else None
+            batch.append((row_no, req, partner))
+            if len(batch) >= chunk_size:
+                # stop reading the upload until dispatch catches up, so queued work
+                # (not just the current chunk) stays bounded however large the file is
+                await run_in_threadpool(wait_for_bulk_capacity)
+                yield await run_in_threadpool(_insert_chunk, batch)
+                batch = []
+    except ValueError as e:
+        # malformed stream (bad encoding / runaway line): report and stop reading
+        yield json.dumps({"ok": False, "error": f"stream aborted: {e}"}) + "\n"
+    if batch:
+        yield await run_in_threadpool(_insert_chunk, batch)
@@ -0,0 +1,136 @@
+"""Driver wallet ledger: append-only postings with batched balance roll-ups.
+Completed jobs are posted to `wallet_postings` in bulk (idempotent per job/kind) and
+`DriverWallet.balance` is only touched by `rollup_balances`, once per driver per run,
+so busy drivers finishing jobs never contend on their wallet row.
+Run end-of-day settlement inside the container with:
+    python -m app.ledger
+"""
+
+from decimal import Decimal
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+
+from .db import SessionLocal
+from . import models
+from .pricing import payout_split
+
+JOB_PAYOUT = "job_payout"
+PLATFORM_CUT = "platform_cut"
+ADJUSTMENT = "adjustment"
+# kinds that move the driver's balance; platform cut is kept for reconciliation only
+BALANCE_KINDS = (JOB_PAYOUT, ADJUSTMENT)
+
+CHUNK_SIZE = 5000  # jobs per SELECT/INSERT round
+
+def job_postings(job_id, driver_id, total):
+    split = payout_split(total)
+    return [
+        {"id": models.gen_uuid(), "driver_id": driver_id, "job_id": job_id,
+         "kind": JOB_PAYOUT, "amount": split["provider"]},
+        {"id": models.gen_uuid(), "driver_id": driver_id, "job_id": job_id,
+         "kind": PLATFORM_CUT, "amount": split["platform_cut"]},
+    ]
+
+def post(db, rows):
+    """Bulk-insert postings; rows already posted for the same (job_id, kind) are skipped."""
+    if not rows:
+        return 0
+    # executemany over a Core insert is batched into multi-row INSERTs by SQLAlchemy
+    table = models.WalletPosting.__table__
+    stmt = (insert(table).on_conflict_do_nothing(index_elements=["job_id", "kind"])
+            .returning(table.c.id))
+    inserted = len(db.execute(stmt, rows).all())
+    db.commit()
+    return inserted
+
+def post_adjustment(db, driver_id, amount, memo=None):
+    posting = models.WalletPosting(driver_id=driver_id, kind=ADJUSTMENT,
+                                   amount=Decimal(str(amount)), memo=memo)
+    db.add(posting)
+    db.commit()
+    db.refresh(posting)
+    return posting
+
+def post_completed_jobs(db, chunk_size=CHUNK_SIZE):
+    """
+    Post payouts for every completed job that has no payout yet.
+    Walks jobs by primary key in chunks (one SELECT + one batched INSERT per chunk),
+    committing as it goes so an interrupted run can simply be restarted.
+    """
+    posted = 0
+    last_id = None
+    while True:
+        q = (db.query(models.Job.id, models.Job.driver_id, models.Job.total_amount)
+             .outerjoin(models.WalletPosting, (models.WalletPosting.job_id == models.Job.id)
+                        & (models.WalletPosting.kind == JOB_PAYOUT))
+             .filter(models.Job.status == "completed",
+                     models.Job.driver_id.isnot(None),
+                     models.Job.total_amount.isnot(None),
+                     models.WalletPosting.id.is_(None)))
+        if last_id is not None:
+            q = q.filter(models.Job.id > last_id)
+        chunk = q.order_by(models.Job.id).limit(chunk_size).all()
+        if not chunk:
+            return posted
+        rows = []
+        for job_id, driver_id, total in chunk:
+            rows.extend(job_postings(job_id, driver_id, total))
+        posted += post(db, rows)
+        last_id = chunk[-1][0]
+
+def rollup_balances(db, driver_id=None):
+    """
+    Fold unsettled postings into DriverWallet.balance in one transaction.
+    Postings are first claimed with a settlement id so concurrent inserts are left for
+    the next run; returns {driver_id: amount applied}.
+    """
+    settlement_id = models.gen_uuid()
+    claim = db.query(models.WalletPosting).filter(models.WalletPosting.settlement_id.is_(None))
+    if driver_id is not None:
+        claim = claim.filter(models.WalletPosting.driver_id == driver_id)
+    claim.update({models.WalletPosting.settlement_id: settlement_id}, synchronize_session=False)
+
+    totals = dict(
+        db.query(models.WalletPosting.driver_id, func.sum(models.WalletPosting.amount))
+        .filter(models.WalletPosting.settlement_id == settlement_id,
+                models.WalletPosting.kind.in_(BALANCE_KINDS))
+        .group_by(models.WalletPosting.driver_id)
+        .all()
+    )
+    if not totals:
+        db.commit()
+        return {}
+
+    # the increment happens in the database (balance = balance + amount), so concurrent
+    # roll-ups never overwrite each other; the unique driver_id makes a missing wallet
+    # an insert-or-add instead of a second wallet row
+    table = models.DriverWallet.__table__
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["driver_id"],
+        set_={"balance": func.coalesce(table.c.balance, 0) + stmt.excluded.balance})
+    db.execute(stmt, [{"id": models.gen_uuid(), "driver_id": drv_id, "balance": amount}
+                      for drv_id, amount in totals.items()])
+    db.commit()
+    return totals
+
+def pending_amount(db, driver_id):
+    amount = (db.query(func.sum(models.WalletPosting.amount))
+              .filter(models.WalletPosting.driver_id == driver_id,
+                      models.WalletPosting.settlement_id.is_(None),
+                      models.WalletPosting.kind.in_(BALANCE_KINDS))
+              .scalar())
+    return amount or Decimal("0.00")
+
+def settle():
+    db = SessionLocal()
+    try:
+        posted = post_completed_jobs(db)
+        totals = rollup_balances(db)
+    finally:
+        db.close()
+    return {"postings": posted, "drivers": len(totals)}
+
+if __name__ == "__main__":
+    print("Settling wallets...")
+    print(settle())
@@ -0,0 +1,154 @@
+"""Heartbeat-based liveness for online drivers / providers.
+Each heartbeat only records a timestamp; expiry is driven by a hierarchical timing
+wheel holding one timer per tracked key. When a timer fires the key is either
+re-armed from its latest heartbeat or expired, so a tick costs O(1) per due key no
+matter how many drivers are online. Expired keys are handed to `on_expire` as one
+batch per tick (e.g. a single UPDATE ... SET is_online = false).
+No DB / web imports here so the dispatch simulator can drive it with a virtual clock.
+"""
+
+import threading
+import time
+
+class TimingWheel:
+    """
+    Hierarchical timing wheel over integer ticks.
+    Level L has `slots` buckets of slots**L ticks each; timers cascade down a level
+    when their bucket comes up. schedule / cancel are O(1), advance is O(1) amortised.
+    """
+
+    def __init__(self, slots=64, levels=4):
+        self.slots = slots
+        self.levels = levels
+        self.now = 0
+        self._wheels = [[set() for _ in range(slots)] for _ in range(levels)]
+        self._where = {}  # key -> (level, slot, deadline)
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, key):
+        return key in self._where
+
+    def _place(self, key, deadline):
+        delta = max(deadline - self.now, 0)
+        level, span = 0, self.slots
+        while delta >= span and level < self.levels - 1:
+            level += 1
+            span *= self.slots
+        # beyond the top level's range: park in the furthest bucket and re-place on cascade
+        at = deadline if delta < span else self.now + span - 1
+        slot = (at // self.slots ** level) % self.slots
+        self._wheels[level][slot].add(key)
+        self._where[key] = (level, slot, deadline)
+
+    def schedule(self, key, deadline):
+        """(Re)arm the timer for key to fire at absolute tick `deadline`."""
+        self.cancel(key)
+        self._place(key, max(deadline, self.now + 1))
+
+    def cancel(self, key):
+        where = self._where.pop(key, None)
+        if where is not None:
+            self._wheels[where[0]][where[1]].discard(key)
+
+    def advance(self):
+        """Move forward one tick and return the keys whose timers fired."""
+        self.now += 1
+        for level in range(self.levels - 1, 0, -1):
+            size = self.slots ** level
+            if self.now % size:
+                continue
+            bucket = self._wheels[level][(self.now // size) % self.slots]
+            entries = list(bucket)
+            bucket.clear()
+            for key in entries:
+                self._place(key, self._where[key][2])
+        bucket = self._wheels[0][self.now % self.slots]
+        due = []
+        for key in list(bucket):
+            if self._where[key][2] <= self.now:
+                bucket.discard(key)
+                del self._where[key]
+                due.append(key)
+        return due
+
+class LivenessTracker:
+    """Tracks last heartbeat per key and expires keys silent for longer than `ttl` seconds."""
+
+    def __init__(self, ttl=30.0, tick=1.0, on_expire=None, clock=time.monotonic):
+        self.ttl = ttl
+        self.tick_seconds = tick
+        self.on_expire = on_expire
+        self.clock = clock
+        self._origin = clock()
+        self._wheel = TimingWheel()
+        self._last_seen = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _to_tick(self, t):
+        return int((t - self._origin) / self.tick_seconds)
+
+    def __len__(self):
+        return len(self._last_seen)
+
+    def heartbeat(self, key):
+        """Record a heartbeat, starting to track key if needed."""
+        now = self.clock()
+        with self._lock:
+            if key not in self._last_seen:
+                self._wheel.schedule(key, self._to_tick(now + self.ttl) + 1)
+            self._last_seen[key] = now
+
+    def touch(self, key):
+        """Heartbeat only if key is already tracked; returns whether it was."""
+        with self._lock:
+            if key not in self._last_seen:
+                return False
+            self._last_seen[key] = self.clock()
+            return True
+
+    def remove(self, key):
+        with self._lock:
+            self._last_seen.pop(key, None)
+            self._wheel.cancel(key)
+
+    def is_alive(self, key):
+        return key in self._last_seen
+
+    def tick(self):
+        """Advance the wheel to the current time and fire `on_expire` with expired keys."""
+        now = self.clock()
+        expired = []
+        with self._lock:
+            target = self._to_tick(now)
+            while self._wheel.now < target:
+                for key in self._wheel.advance():
+                    seen = self._last_seen.get(key)
+                    if seen is None:
+                        continue
+                    if seen + self.ttl > now:
+                        # heard from since the timer was armed: re-arm from the last heartbeat
+                        self._wheel.schedule(key, self._to_tick(seen + self.ttl) + 1)
+                    else:
+                        del self._last_seen[key]
+                        expired.append(key)
+        if expired and self.on_expire:
+            self.on_expire(expired)
+        return expired
+
+    def _run(self):
+        while True:
+            time.sleep(self.tick_seconds)
+            try:
+                self.tick()
+            except Exception as e:
+                print("Liveness tick failed:", e)
+
+    def start(self):
+        """Run ticks on a daemon thread (idempotent)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="liveness", daemon=True)
+            self._thread.start()
+        return self
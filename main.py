@@ -1,18 +1,160 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, BackgroundTasks
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, Request, Header
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import and_, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from typing import Optional, Dict, Any
+from datetime import datetime, timedelta
+import json
 import threading
 import time
+import uuid
 
 from .db import get_db_session, engine, SessionLocal
 from . import models
-from .dispatch import start_dispatch_worker
+from .create_tables import upgrade_columns
+from .dispatch import enqueue_dispatch, queue_depth
+from .ratings import record_rating, AlreadyRated
+from . import ledger
+from .ingest import ingest_stream, IngestResponse
+from . import export
+from .liveness import LivenessTracker
+from . import codec
+from . import geofence
+from .admission import AdmissionMiddleware, REQUEST
+from . import idempotency
 
 app = FastAPI(title="Towing & Roadside Assistance API", version="0.2.0")
 
 # Simple startup: create tables if they don't exist
 models.Base.metadata.create_all(bind=engine)
+upgrade_columns(engine)
+
+# Admission control: shed load before it reaches dispatch / the DB pool
+DISPATCH_QUEUE_HIGH = 200  # queued dispatches considered "full"
+
+
+def dispatch_queue_load():
+    return queue_depth() / DISPATCH_QUEUE_HIGH
+
+
+def db_pool_load():
+    pool = engine.pool
+    return pool.checkedout() / (pool.size() + pool._max_overflow)
+
+
+app.add_middleware(AdmissionMiddleware, routes={("POST", "/jobs/request"): REQUEST},
+                   load_signals=[dispatch_queue_load, db_pool_load])
+
+# Drivers that stop heartbeating (HTTP or WebSocket) are flipped offline in batches.
+# Each worker process keeps its own timing wheel, but the decision is taken against
+# drivers.last_heartbeat_at, which every worker writes (throttled) for the heartbeats
+# it receives; a worker whose timer fires for a driver heard from elsewhere re-arms it.
+DRIVER_HEARTBEAT_TTL = 60.0  # seconds
+HEARTBEAT_PERSIST_SECONDS = DRIVER_HEARTBEAT_TTL / 3  # per driver per worker
+_heartbeat_persisted = {}  # driver id -> monotonic time of our last last_heartbeat_at write
+_offline_checked = {}  # ids found offline in the DB -> monotonic time of that check
+
+
+def mark_drivers_offline(driver_ids, force=False):
+    # one UPDATE per liveness tick; skip drivers that came back online meanwhile, and
+    # (unless forced) drivers whose shared heartbeat is still fresh
+    ids = [d for d in driver_ids if not driver_liveness.is_alive(d)]
+    if not ids:
+        return
+    for d in ids:
+        _heartbeat_persisted.pop(d, None)
+    db = SessionLocal()
+    try:
+        q = db.query(models.Driver).filter(models.Driver.id.in_(ids))
+        if not force:
+            cutoff = datetime.utcnow() - timedelta(seconds=DRIVER_HEARTBEAT_TTL)
+            q = q.filter(or_(models.Driver.last_heartbeat_at.is_(None),
+                             models.Driver.last_heartbeat_at < cutoff))
+        q.update({models.Driver.is_online: False}, synchronize_session=False)
+        db.commit()
+        if not force:
+            # still online: heartbeating through another worker, keep watching them
+            still = db.query(models.Driver.id).filter(models.Driver.id.in_(ids),
+                                                      models.Driver.is_online == True).all()
+            for (driver_id,) in still:
+                driver_liveness.heartbeat(str(driver_id))
+    finally:
+        db.close()
+
+
+driver_liveness = LivenessTracker(ttl=DRIVER_HEARTBEAT_TTL, on_expire=mark_drivers_offline)
+
+
+def _valid_uuid(value):
+    try:
+        uuid.UUID(value)
+    except ValueError:
+        return False
+    return True
+
+
+def record_driver_heartbeat(driver_id: str, lat: Optional[float] = None, lon: Optional[float] = None):
+    """Record a heartbeat seen by this worker; returns False if the driver is offline."""
+    now = time.monotonic()
+    if not driver_liveness.touch(driver_id):
+        # may have gone online through another worker; look it up (throttled for misses)
+        if now - _offline_checked.get(driver_id, -HEARTBEAT_PERSIST_SECONDS) < HEARTBEAT_PERSIST_SECONDS:
+            return False
+        db = SessionLocal()
+        online = _valid_uuid(driver_id) and db.query(models.Driver.id).filter(
+            models.Driver.id == driver_id, models.Driver.is_online == True).first() is not None
+        db.close()
+        if not online:
+            if len(_offline_checked) > 100000:
+                _offline_checked.clear()
+            _offline_checked[driver_id] = now
+            return False
+        _offline_checked.pop(driver_id, None)
+        driver_liveness.heartbeat(driver_id)
+    values = {}
+    persist = now - _heartbeat_persisted.get(driver_id, -HEARTBEAT_PERSIST_SECONDS) >= HEARTBEAT_PERSIST_SECONDS
+    if persist:
+        values[models.Driver.last_heartbeat_at] = datetime.utcnow()
+    if lat is not None and lon is not None:
+        values[models.Driver.current_lat] = lat
+        values[models.Driver.current_lon] = lon
+    if not values:
+        return True
+    db = SessionLocal()
+    q = db.query(models.Driver).filter(models.Driver.id == driver_id)
+    if persist:
+        # went offline through another worker: stop tracking instead of reviving it
+        q = q.filter(models.Driver.is_online == True)
+    updated = q.update(values, synchronize_session=False)
+    db.commit()
+    db.close()
+    if persist and not updated:
+        driver_liveness.remove(driver_id)
+        return False
+    if persist:
+        _heartbeat_persisted[driver_id] = now
+    return True
+
+
+def heartbeat_is_cheap(driver_id: str):
+    """True if a heartbeat needs no DB round trip (tracked here and recently persisted)."""
+    return (driver_liveness.touch(driver_id) and time.monotonic() - _heartbeat_persisted.get(
+        driver_id, -HEARTBEAT_PERSIST_SECONDS) < HEARTBEAT_PERSIST_SECONDS)
+
+
+@app.on_event("startup")
+def start_liveness():
+    # every worker watches every online driver; expiry re-checks the shared heartbeat,
+    # and drivers left online by a previous process get one TTL to heartbeat
+    db = SessionLocal()
+    online = [row[0] for row in db.query(models.Driver.id).filter(models.Driver.is_online == True)]
+    db.close()
+    for driver_id in online:
+        driver_liveness.heartbeat(str(driver_id))
+    driver_liveness.start()
 
 
 class SignupIn(BaseModel):
@@ -76,12 +218,30 @@ def go_online(driver_id: str, lat: float, lon: float):
     driver.is_online = True
     driver.current_lat = lat
     driver.current_lon = lon
+    driver.last_heartbeat_at = datetime.utcnow()
     db.add(driver)
     db.commit()
     db.close()
+    driver_liveness.heartbeat(driver_id)
+    _heartbeat_persisted[driver_id] = time.monotonic()
+    _offline_checked.pop(driver_id, None)
     return {"ok": True, "driver_id": driver_id, "lat": lat, "lon": lon}
 
 
+@app.post("/driver/{driver_id}/heartbeat")
+def driver_heartbeat(driver_id: str, lat: Optional[float] = None, lon: Optional[float] = None):
+    if not record_driver_heartbeat(driver_id, lat, lon):
+        raise HTTPException(status_code=409, detail="Driver is offline; call go_online")
+    return {"ok": True, "ttl": DRIVER_HEARTBEAT_TTL}
+
+
+@app.post("/driver/{driver_id}/go_offline")
+def go_offline(driver_id: str):
+    driver_liveness.remove(driver_id)
+    mark_drivers_offline([driver_id], force=True)
+    return {"ok": True, "driver_id": driver_id}
+
+
 class JobRequest(BaseModel):
     user_id: str
     pickup_lat: float
@@ -91,47 +251,255 @@ class JobRequest(BaseModel):
     dropoff_lon: Optional[float] = None
 
 
-@app.post("/jobs/request")
-def create_job(req: JobRequest, background_tasks: BackgroundTasks):
+# --- Idempotency-Key support: retries return the original job instead of a new dispatch ---
+job_idempotency = idempotency.IdempotencyCache()
+IDEMPOTENCY_PURGE_SECONDS = 60.0  # how often a worker sweeps expired keys
+IDEMPOTENCY_PURGE_BATCH = 1000  # rows deleted per sweep, so a claim never stalls on a big delete
+_last_idempotency_purge = 0.0
+
+
+def purge_idempotency_keys(db, now: datetime):
+    """Delete one batch of keys past their TTL (uses the created_at index)."""
+    cutoff = now - timedelta(seconds=job_idempotency.ttl)
+    expired = db.query(models.IdempotencyKey.key).filter(
+        models.IdempotencyKey.created_at < cutoff).limit(IDEMPOTENCY_PURGE_BATCH)
+    deleted = db.query(models.IdempotencyKey).filter(
+        models.IdempotencyKey.key.in_(expired.scalar_subquery())).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+
+def claim_idempotency_key(db, key: str, fp: str):
+    """Claim key in the DB; returns None if this request owns it, else the existing row."""
+    global _last_idempotency_purge
+    now = datetime.utcnow()
+    if time.monotonic() - _last_idempotency_purge >= IDEMPOTENCY_PURGE_SECONDS:
+        _last_idempotency_purge = time.monotonic()
+        purge_idempotency_keys(db, now)
+    stmt = pg_insert(models.IdempotencyKey).values(key=key, fingerprint=fp, created_at=now) \
+        .on_conflict_do_nothing(index_elements=["key"])
+    if db.execute(stmt).rowcount == 1:
+        db.commit()
+        return None
+    # keys past their TTL can be reused, and so can claims whose request never finished
+    # (the process died before committing the job) once their short lease runs out
+    cutoff = now - timedelta(seconds=job_idempotency.ttl)
+    lease_cutoff = now - timedelta(seconds=idempotency.IN_FLIGHT_LEASE)
+    taken = db.query(models.IdempotencyKey).filter(
+        models.IdempotencyKey.key == key,
+        or_(models.IdempotencyKey.created_at < cutoff,
+            and_(models.IdempotencyKey.response.is_(None), models.IdempotencyKey.created_at < lease_cutoff))
+    ).update({models.IdempotencyKey.fingerprint: fp, models.IdempotencyKey.response: None,
+              models.IdempotencyKey.job_id: None, models.IdempotencyKey.created_at: now},
+             synchronize_session=False)
+    db.commit()
+    if taken:
+        return None
+    return db.query(models.IdempotencyKey).filter(models.IdempotencyKey.key == key).first()
+
+
+def _create_job(req: JobRequest, verdict: str, area, idempotency_key: Optional[str] = None):
     db = SessionLocal()
     job = models.Job(
         user_id=req.user_id,
         service_type=req.service_type,
-        status="requested",
+        status="referred" if verdict == geofence.PARTNER else "requested",
         pickup_lat=req.pickup_lat,
         pickup_lon=req.pickup_lon,
         dropoff_lat=req.dropoff_lat,
         dropoff_lon=req.dropoff_lon,
     )
     db.add(job)
+    db.flush()
+    result = {"ok": True, "job_id": str(job.id), "status": job.status}
+    if verdict == geofence.PARTNER:
+        # partner zone: recorded for hand-off, not dispatched to our drivers
+        result["partner"] = area.partner_id
+    if idempotency_key:
+        # stored in the same transaction as the job, so a replay always finds both
+        db.query(models.IdempotencyKey).filter(models.IdempotencyKey.key == idempotency_key).update(
+            {models.IdempotencyKey.job_id: job.id, models.IdempotencyKey.response: json.dumps(result)},
+            synchronize_session=False)
     db.commit()
-    db.refresh(job)
     db.close()
 
-    # Enqueue job into dispatch worker via Redis pub/sub (dispatch worker listens)
-    # For this skeleton we'll call a simple in-process dispatcher function asynchronously
-    background_tasks.add_task(start_dispatch_worker, str(job.id), req.pickup_lat, req.pickup_lon, req.service_type)
+    if verdict != geofence.PARTNER:
+        # Enqueue job into dispatch worker via Redis pub/sub (dispatch worker listens)
+        # For this skeleton we hand it to the in-process dispatch pool (bounded, so its
+        # queue depth feeds admission control instead of piling up request threads)
+        enqueue_dispatch(result["job_id"], req.pickup_lat, req.pickup_lon, req.service_type)
+    return result
 
-    return {"ok": True, "job_id": str(job.id), "status": job.status}
+
+def _create_job_idempotent(key: str, fp: str, req: JobRequest, verdict: str, area):
+    """Returns (response, replayed); only the request that claims the key creates a job."""
+    db = SessionLocal()
+    row = claim_idempotency_key(db, key, fp)
+    db.close()
+    if row is not None:
+        if row.fingerprint != fp:
+            raise idempotency.KeyReused(key)
+        if row.response is None:
+            raise idempotency.InFlight(key)  # claimed by another worker process
+        return json.loads(row.response), True
+    try:
+        return _create_job(req, verdict, area, idempotency_key=key), False
+    except BaseException:
+        # free the key so the client's retry can go through
+        db = SessionLocal()
+        db.query(models.IdempotencyKey).filter(models.IdempotencyKey.key == key).delete(synchronize_session=False)
+        db.commit()
+        db.close()
+        raise
+
+
+@app.post("/jobs/request")
+def create_job(req: JobRequest, idempotency_key: Optional[str] = Header(None)):
+    # geofence admission before touching the DB
+    verdict, area = geofence.service_areas.check(req.pickup_lat, req.pickup_lon)
+    if verdict == geofence.REJECT:
+        raise HTTPException(status_code=422, detail="Pickup is outside our service area")
+    if not idempotency_key:
+        return _create_job(req, verdict, area)
+
+    fp = idempotency.fingerprint(jsonable_encoder(req))
+    try:
+        (result, stored), cached = job_idempotency.run(
+            idempotency_key, fp, lambda: _create_job_idempotent(idempotency_key, fp, req, verdict, area))
+    except idempotency.KeyReused:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    except idempotency.InFlight:
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress",
+                            headers={"Retry-After": "1"})
+    if stored or cached:
+        return JSONResponse(result, headers={"Idempotent-Replayed": "true"})
+    return result
+
+
+@app.post("/jobs/bulk")
+async def bulk_ingest(request: Request, format: Optional[str] = None):
+    # Streamed NDJSON (default) or CSV body with JobRequest fields; one result line per row
+    fmt = format or ("csv" if "csv" in request.headers.get("content-type", "") else "ndjson")
+    if fmt not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+    return IngestResponse(ingest_stream(request.stream(), fmt, JobRequest))
+
+
+class RatingIn(BaseModel):
+    stars: int
+    from_user: Optional[str] = None
+    comment: Optional[str] = None
+
+
+@app.post("/jobs/{job_id}/rating")
+def rate_job(job_id: str, payload: RatingIn):
+    db = SessionLocal()
+    job = db.query(models.Job).filter(models.Job.id == job_id).first()
+    if not job or not job.driver_id:
+        db.close()
+        raise HTTPException(status_code=404, detail="Job not found or not assigned")
+    if job.status != "completed":
+        db.close()
+        raise HTTPException(status_code=409, detail="Only completed jobs can be rated")
+    try:
+        rating = record_rating(db, job.id, job.driver_id, payload.stars,
+                               from_user=payload.from_user, comment=payload.comment)
+    except ValueError as e:
+        db.close()
+        raise HTTPException(status_code=400, detail=str(e))
+    except AlreadyRated:
+        db.close()
+        raise HTTPException(status_code=409, detail="Job has already been rated")
+    rating_id = str(rating.id)
+    db.close()
+    return {"ok": True, "rating_id": rating_id}
+
+
+@app.get("/driver/{driver_id}/wallet")
+def driver_wallet(driver_id: str):
+    db = SessionLocal()
+    wallet = db.query(models.DriverWallet).filter(models.DriverWallet.driver_id == driver_id).first()
+    balance = wallet.balance if wallet and wallet.balance is not None else 0
+    pending = ledger.pending_amount(db, driver_id)
+    db.close()
+    return {"ok": True, "driver_id": driver_id, "balance": str(balance), "pending": str(pending)}
+
+
+@app.post("/driver/{driver_id}/wallet/rollup")
+def wallet_rollup(driver_id: str):
+    # fold this driver's pending postings into the balance now instead of at settlement
+    db = SessionLocal()
+    totals = ledger.rollup_balances(db, driver_id=driver_id)
+    db.close()
+    return {"ok": True, "driver_id": driver_id, "applied": str(totals.get(driver_id, 0))}
+
+
+class AdjustmentIn(BaseModel):
+    amount: float
+    memo: Optional[str] = None
+
+
+@app.post("/driver/{driver_id}/wallet/adjustments")
+def wallet_adjustment(driver_id: str, payload: AdjustmentIn):
+    db = SessionLocal()
+    drv = db.query(models.Driver).filter(models.Driver.id == driver_id).first()
+    if not drv:
+        db.close()
+        raise HTTPException(status_code=404, detail="Driver not found")
+    posting = ledger.post_adjustment(db, driver_id, payload.amount, memo=payload.memo)
+    posting_id = str(posting.id)
+    db.close()
+    return {"ok": True, "posting_id": posting_id}
+
+
+@app.post("/wallets/settle")
+def settle_wallets():
+    # end-of-day: post all completed jobs, then roll balances up in one pass
+    return {"ok": True, **ledger.settle()}
+
+
+@app.get("/jobs/export")
+def export_jobs(start: Optional[datetime] = None, end: Optional[datetime] = None,
+                status: Optional[str] = None, service_type: Optional[str] = None,
+                format: str = "ndjson"):
+    rows = export.iter_jobs(start=start, end=end, status=status, service_type=service_type)
+    if format == "csv":
+        return StreamingResponse(export.csv_chunks(rows), media_type="text/csv",
+                                 headers={"Content-Disposition": "attachment; filename=jobs.csv"})
+    if format != "ndjson":
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+    return StreamingResponse(export.ndjson_chunks(rows), media_type="application/x-ndjson")
 
 
 # --- WebSocket manager for real-time updates (drivers & users) ---
 class ConnectionManager:
     def __init__(self):
         self.active_connections: Dict[str, WebSocket] = {}
+        self.binary_clients = set()  # negotiated the compact binary subprotocol
 
     async def connect(self, websocket: WebSocket, client_id: str):
-        await websocket.accept()
+        subprotocol, binary = codec.negotiate(websocket)
+        await websocket.accept(subprotocol=subprotocol)
         self.active_connections[client_id] = websocket
-
-    def disconnect(self, client_id: str):
+        if binary:
+            self.binary_clients.add(client_id)
+        else:
+            self.binary_clients.discard(client_id)
+
+    def disconnect(self, client_id: str, websocket: Optional[WebSocket] = None):
+        # a client that reconnected under the same id keeps its newer socket
+        if websocket is not None and self.active_connections.get(client_id) is not websocket:
+            return
         if client_id in self.active_connections:
             del self.active_connections[client_id]
+        self.binary_clients.discard(client_id)
 
-    async def send_personal_message(self, message: dict, client_id: str):
+    async def send_personal_message(self, message, client_id: str):
+        # accepts a dict or a pre-encoded codec.Event shared across recipients
         ws = self.active_connections.get(client_id)
         if ws:
-            await ws.send_json(message)
+            event = message if isinstance(message, codec.Event) else codec.Event(message)
+            await codec.send(ws, event, client_id in self.binary_clients)
 
 
 manager = ConnectionManager()
@@ -142,11 +510,25 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
     await manager.connect(websocket, client_id)
     try:
         while True:
-            data = await websocket.receive_text()
-            # echo for now
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                break
+            # drivers' sockets double as a heartbeat channel
+            if not heartbeat_is_cheap(client_id):
+                await run_in_threadpool(record_driver_heartbeat, client_id)
+            # echo for now (binary frames are echoed decoded)
+            if frame.get("bytes") is not None:
+                try:
+                    data = codec.unpack(frame["bytes"])
+                except ValueError:
+                    continue
+            else:
+                data = frame.get("text")
             await manager.send_personal_message({"echo": data}, client_id)
     except WebSocketDisconnect:
-        manager.disconnect(client_id)
+        pass
+    finally:
+        manager.disconnect(client_id, websocket)
 
 
 # Simple health
@@ -1,7 +1,8 @@
-from sqlalchemy import Column, String, Float, Boolean, Integer, ForeignKey, Numeric
+from sqlalchemy import Column, String, Float, Boolean, Integer, ForeignKey, Numeric, DateTime, UniqueConstraint, Text
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.declarative import declarative_base
 import uuid
+from datetime import datetime
 
 Base = declarative_base()
 
@@ -19,6 +20,12 @@ class Driver(Base):
     id = Column(UUID(as_uuid=False), primary_key=True, default=gen_uuid)
     display_name = Column(String(200))
     rating = Column(Float, default=5.0)
+    # rating aggregates maintained incrementally on insert (see ratings.record_rating)
+    rating_count = Column(Integer, default=0)
+    rating_sum = Column(Integer, default=0)
+    rating_recent = Column(Float, default=5.0)  # exponentially decayed average
+    last_assigned_at = Column(DateTime, nullable=True)  # used for idle-time ranking
+    last_heartbeat_at = Column(DateTime, nullable=True)  # shared across workers (see main.py liveness)
     is_online = Column(Boolean, default=False)
     # simple lat/lon columns for demo (in production use PostGIS Point)
     current_lat = Column(Float, nullable=True)
@@ -48,18 +55,43 @@ class Job(Base):
     distance_miles = Column(Float, nullable=True)
     extra_charges = Column(Numeric(10,2), default=0.00)
     total_amount = Column(Numeric(10,2), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
 
 class DriverWallet(Base):
     __tablename__ = "driver_wallets"
+    __table_args__ = (UniqueConstraint("driver_id", name="uq_driver_wallets_driver_id"),)
     id = Column(UUID(as_uuid=False), primary_key=True, default=gen_uuid)
     driver_id = Column(UUID(as_uuid=False), ForeignKey("drivers.id"))
-    balance = Column(Numeric(12,2), default=0.00)
+    balance = Column(Numeric(12,2), default=0.00)  # rolled up from wallet_postings
+
+class WalletPosting(Base):
+    # append-only ledger; balances are rolled up from here in bulk (see ledger.py)
+    __tablename__ = "wallet_postings"
+    __table_args__ = (UniqueConstraint("job_id", "kind", name="uq_wallet_postings_job_kind"),)
+    id = Column(UUID(as_uuid=False), primary_key=True, default=gen_uuid)
+    driver_id = Column(UUID(as_uuid=False), ForeignKey("drivers.id"), index=True)
+    job_id = Column(UUID(as_uuid=False), ForeignKey("jobs.id"), nullable=True)
+    kind = Column(String(32))  # job_payout | platform_cut | adjustment
+    amount = Column(Numeric(12,2))
+    memo = Column(String(200), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    settlement_id = Column(UUID(as_uuid=False), nullable=True, index=True)  # set when rolled up
 
 class Rating(Base):
     __tablename__ = "ratings"
+    __table_args__ = (UniqueConstraint("job_id", name="uq_ratings_job_id"),)  # one rating per job
     id = Column(UUID(as_uuid=False), primary_key=True, default=gen_uuid)
     job_id = Column(UUID(as_uuid=False), ForeignKey("jobs.id"))
     from_user = Column(UUID(as_uuid=False), nullable=True)
     to_driver = Column(UUID(as_uuid=False), nullable=True)
     stars = Column(Integer)
     comment = Column(String(500))
+
+class IdempotencyKey(Base):
+    # client Idempotency-Key for POST /jobs/request; response is NULL while in flight
+    __tablename__ = "idempotency_keys"
+    key = Column(String(255), primary_key=True)
+    fingerprint = Column(String(64))
+    job_id = Column(UUID(as_uuid=False), ForeignKey("jobs.id"), nullable=True)
+    response = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
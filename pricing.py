@@ -3,6 +3,13 @@ from decimal import Decimal, ROUND_HALF_UP
 def _money(x):
     return Decimal(x).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
 
+def payout_split(total):
+    # split a job total into platform cut / provider payout (same 20% rule as below)
+    total = _money(total)
+    cut = _money(total * Decimal("0.20"))
+    provider = _money(total - cut)
+    return {"total": total, "platform_cut": cut, "provider": provider}
+
 def regular_tow(miles_total: float):
     base = Decimal("105.00")
     included = Decimal("7")
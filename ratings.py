@@ -0,0 +1,57 @@
+"""Driver rating aggregates.
+Ratings are folded into the driver row as they are inserted (count, sum and an
+exponentially decayed recent average), so dispatch can rank drivers from the
+`drivers` table alone instead of aggregating `ratings` per driver per job.
+"""
+
+from sqlalchemy import Float, cast, func
+from sqlalchemy.exc import IntegrityError
+
+from . import models
+
+# weight of the newest rating in the decayed average (~ last 10 ratings dominate)
+RECENT_ALPHA = 0.1
+DEFAULT_RATING = 5.0
+
+class AlreadyRated(Exception):
+    """The job already has a rating."""
+
+def record_rating(db, job_id, to_driver, stars, from_user=None, comment=None):
+    """Insert a Rating row and update the driver's aggregates in the same transaction."""
+    if stars < 1 or stars > 5:
+        raise ValueError("stars must be between 1 and 5")
+    if db.query(models.Rating.id).filter(models.Rating.job_id == job_id).first():
+        raise AlreadyRated(job_id)
+    rating = models.Rating(job_id=job_id, from_user=from_user, to_driver=to_driver,
+                           stars=stars, comment=comment)
+    db.add(rating)
+    try:
+        db.flush()  # unique job_id catches a concurrent rating before the aggregates move
+    except IntegrityError:
+        db.rollback()
+        raise AlreadyRated(job_id)
+
+    # single UPDATE; every right-hand side sees the pre-update values
+    count = func.coalesce(models.Driver.rating_count, 0)
+    total = func.coalesce(models.Driver.rating_sum, 0)
+    recent = func.coalesce(models.Driver.rating_recent, DEFAULT_RATING)
+    # bias-corrected EMA: rating_recent stores raw / (1 - (1-a)^n), so undo the correction
+    # for n-1, fold in the new rating and re-correct for n; the first rating is taken as-is
+    # instead of being pulled toward the 5.0 starting value
+    decay = 1 - RECENT_ALPHA
+    raw = recent * (1 - func.power(decay, count)) * decay + stars * RECENT_ALPHA
+    db.query(models.Driver).filter(models.Driver.id == to_driver).update({
+        models.Driver.rating_count: count + 1,
+        models.Driver.rating_sum: total + stars,
+        models.Driver.rating: cast(total + stars, Float) / (count + 1),
+        models.Driver.rating_recent: raw / (1 - func.power(decay, count + 1)),
+    }, synchronize_session=False)
+    db.commit()
+    db.refresh(rating)
+    return rating
+
+def effective_rating(driver):
+    """Rating used for ranking: recent average once the driver has any ratings."""
+    if driver.rating_count:
+        return driver.rating_recent if driver.rating_recent is not None else driver.rating
+    return driver.rating if driver.rating is not None else DEFAULT_RATING
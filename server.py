@@ -1,8 +1,17 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response, Header
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 
 app = FastAPI(title="Road Guard API (minimal)")
 
+# Shed quotes first, then requests (accident tows never) when overloaded
+try:
+    from .admission import AdmissionMiddleware, QUOTE, REQUEST
+except ImportError:  # run as a top-level module (uvicorn server:app)
+    from admission import AdmissionMiddleware, QUOTE, REQUEST
+app.add_middleware(AdmissionMiddleware, routes={("POST", "/quote"): QUOTE, ("POST", "/requests"): REQUEST})
+
 # Keep CORS open for now; we'll tighten later to your Base44 domain
 app.add_middleware(
     CORSMiddleware,
@@ -15,59 +24,91 @@ app.add_middleware(
 @app.get("/health")
 def health():
     return {"status": "ok"}
-# --- WebSocket endpoint ---
-from fastapi import WebSocket, WebSocketDisconnect
-
-@app.websocket("/ws")
-async def websocket_endpoint(ws: WebSocket):
-    await ws.accept()
-    try:
-        # Send a hello so the frontend knows it's connected
-        await ws.send_json({"type": "hello", "msg": "road-guard ws connected"})
-        # Echo any message back for basic testing
-        while True:
-            msg = await ws.receive_text()
-            await ws.send_json({"type": "echo", "msg": msg})
-    except WebSocketDisconnect:
-        pass
 # --- WebSocket endpoint (simple hello + echo) ---
 from fastapi import WebSocket, WebSocketDisconnect
+from typing import Optional
+try:
+    from . import codec
+except ImportError:  # run as a top-level module (uvicorn server:app)
+    import codec
+
+# id(ws) -> (ws, binary); binary sockets negotiated the roadguard.bin.v1 subprotocol
+ACTIVE_SOCKETS = {}
+_LOOP = None
 
-ACTIVE_SOCKETS = []
+@app.on_event("startup")
+async def _capture_loop():
+    global _LOOP
+    _LOOP = asyncio.get_running_loop()
 
 @app.websocket("/ws")
-async def websocket_endpoint(ws: WebSocket):
-    await ws.accept()
-    ACTIVE_SOCKETS.append(ws)
+async def websocket_endpoint(ws: WebSocket, provider_id: Optional[str] = None):
+    subprotocol, binary = codec.negotiate(ws)
+    await ws.accept(subprotocol=subprotocol)
+    ACTIVE_SOCKETS[id(ws)] = (ws, binary)
     try:
-        await ws.send_json({"type": "hello", "msg": "road-guard ws connected"})
+        await codec.send(ws, codec.Event({"type": "hello", "msg": "road-guard ws connected"}), binary)
         while True:
-            # keep alive; echo any text messages
-            msg = await ws.receive_text()
-            await ws.send_json({"type": "echo", "msg": msg})
+            # keep alive; echo text messages, apply binary location frames
+            frame = await ws.receive()
+            if frame["type"] == "websocket.disconnect":
+                break
+            if provider_id:
+                # any frame from an online provider counts as a heartbeat
+                PROVIDER_LIVENESS.touch(provider_id)
+            if frame.get("bytes") is not None:
+                _apply_provider_frame(provider_id, frame["bytes"])
+                continue
+            await codec.send(ws, codec.Event({"type": "echo", "msg": frame.get("text")}), binary)
     except WebSocketDisconnect:
         pass
     finally:
-        if ws in ACTIVE_SOCKETS:
-            ACTIVE_SOCKETS.remove(ws)
+        ACTIVE_SOCKETS.pop(id(ws), None)
+
+def _apply_provider_frame(provider_id, data: bytes):
+    prov = PROVIDERS.get(provider_id) if provider_id else None
+    if not prov or not data or data[0] != codec.FRAME_LOCATION:
+        return
+    try:
+        update = codec.unpack(data)
+    except ValueError:
+        return
+    prov["lat"], prov["lng"] = update["lat"], update["lon"]
 
-# helper to push events to all connected clients
+# helper to push events to all connected clients; each event is encoded once per format
 async def broadcast(msg: dict):
+    event = codec.Event(msg)
     dead = []
-    for s in ACTIVE_SOCKETS:
+    for key, (s, binary) in list(ACTIVE_SOCKETS.items()):
         try:
-            await s.send_json(msg)
+            await codec.send(s, event, binary)
         except Exception:
-            dead.append(s)
-    for s in dead:
-        if s in ACTIVE_SOCKETS:
-            ACTIVE_SOCKETS.remove(s)
-            # --- Pricing & helpers (no DB; all in-memory) ---
+            dead.append(key)
+    for key in dead:
+        ACTIVE_SOCKETS.pop(key, None)
+
+def publish(msg: dict):
+    """Schedule a broadcast from either the event loop or a sync endpoint's worker thread."""
+    try:
+        asyncio.get_running_loop().create_task(broadcast(msg))
+    except RuntimeError:
+        if _LOOP is not None:
+            asyncio.run_coroutine_threadsafe(broadcast(msg), _LOOP)
+
+# --- Pricing & helpers (no DB; all in-memory) ---
 from enum import Enum
 from math import radians, sin, cos, asin, sqrt
 from typing import Optional, Dict, Any
 from pydantic import BaseModel
-import time, uuid, asyncio
+import time, uuid, asyncio, threading
+try:
+    from .liveness import LivenessTracker
+    from . import geofence
+    from . import idempotency
+except ImportError:  # run as a top-level module (uvicorn server:app)
+    from liveness import LivenessTracker
+    import geofence
+    import idempotency
 
 APP_CUT = 0.20  # app+tax cut = 20%
 
@@ -160,10 +201,73 @@ class ProviderOnlineReq(BaseModel):
 REQUESTS: Dict[str, Dict] = {}
 PROVIDERS: Dict[str, Dict] = {}
 JOBS: Dict[str, Dict] = {}
+
+# providers that stop heartbeating are dropped from the candidate pool
+PROVIDER_HEARTBEAT_TTL = 45.0  # seconds
+
+_PROVIDERS_LOCK = threading.Lock()  # orders /providers/online against expiry
+
+def _expire_providers(provider_ids):
+    # the tracker fires after releasing its own lock, so a provider may have come back
+    # online in between; only drop the ones that are still expired
+    with _PROVIDERS_LOCK:
+        for pid in provider_ids:
+            if not PROVIDER_LIVENESS.is_alive(pid):
+                PROVIDERS.pop(pid, None)
+
+PROVIDER_LIVENESS = LivenessTracker(ttl=PROVIDER_HEARTBEAT_TTL, on_expire=_expire_providers)
+
+@app.on_event("startup")
+def _start_liveness():
+    # started with the app (as in main.py), not at import time
+    PROVIDER_LIVENESS.start()
+
+# --- Job change feed (delta sync for /jobs/available) ---
+# Every job mutation gets the next sequence number; providers poll with ?since=<cursor>
+# (the cursor is also the ETag) and only receive jobs changed after it.
+CHANGE_LOG_MAX = 10000
+CHANGE_SEQ = 0
+_CHANGE_LOG = []  # (seq, job_id), contiguous seqs, trimmed to ~CHANGE_LOG_MAX
+_CHANGE_LOCK = threading.Lock()
+_CHANGED = None  # asyncio.Event for long-poll waiters, replaced on every change
+LONG_POLL_MAX = 30.0  # seconds
+
+def _record_change(job_id: str):
+    global CHANGE_SEQ, _CHANGE_LOG
+    with _CHANGE_LOCK:
+        CHANGE_SEQ += 1
+        _CHANGE_LOG.append((CHANGE_SEQ, job_id))
+        if len(_CHANGE_LOG) > 2 * CHANGE_LOG_MAX:
+            _CHANGE_LOG = _CHANGE_LOG[-CHANGE_LOG_MAX:]
+    if _LOOP is not None:
+        _LOOP.call_soon_threadsafe(_wake_waiters)
+
+def _wake_waiters():
+    global _CHANGED
+    if _CHANGED is not None:
+        _CHANGED.set()
+        _CHANGED = None
+
+def _changes_since(cursor: int):
+    """Job ids changed after cursor and the current seq, or None if cursor is no longer covered."""
+    with _CHANGE_LOCK:
+        seq, log = CHANGE_SEQ, _CHANGE_LOG
+        if cursor == seq:
+            return set(), seq
+        if cursor > seq or not log or cursor < log[0][0] - 1:
+            return None, seq
+        offset = cursor - log[0][0] + 1  # seqs in the log are contiguous
+        return {job_id for _, job_id in log[offset:]}, seq
 # --- Endpoints ---
 
 @app.post("/quote")
 def quote(body: QuoteReq):
+    # geofence check before any work
+    verdict, area = geofence.service_areas.check(body.pickup_lat, body.pickup_lng)
+    if verdict == geofence.REJECT:
+        return {"ok": False, "error": "out_of_service_area"}
+    if verdict == geofence.PARTNER:
+        return {"ok": False, "error": "partner_zone", "partner": area.partner_id, "area": area.name}
     miles = 0.0
     if body.drop_lat is not None and body.drop_lng is not None:
         miles = haversine_miles(body.pickup_lat, body.pickup_lng, body.drop_lat, body.drop_lng)
@@ -171,9 +275,36 @@ def quote(body: QuoteReq):
     price = compute_price(body.service, miles, within5mi=within5)
     return {"miles": round(miles, 2), **price}
 
+# retries with the same Idempotency-Key get the original request back (no second job)
+REQUEST_IDEMPOTENCY = idempotency.IdempotencyCache()
+
 @app.post("/requests")
-def create_request(body: RequestServiceReq):
+def create_request(body: RequestServiceReq, idempotency_key: Optional[str] = Header(None)):
+    if not idempotency_key:
+        return _create_request(body)
+    fp = idempotency.fingerprint(jsonable_encoder(body))
+    try:
+        result, _ = REQUEST_IDEMPOTENCY.run(idempotency_key, fp, lambda: _create_request(body),
+                                            store=lambda r: r.get("ok", True))
+    except idempotency.KeyReused:
+        return {"ok": False, "error": "idempotency_key_reused"}
+    except idempotency.InFlight:
+        return {"ok": False, "error": "idempotency_key_in_flight"}
+    return result
+
+def _create_request(body: RequestServiceReq):
+    verdict, area = geofence.service_areas.check(body.pickup_lat, body.pickup_lng)
+    if verdict == geofence.REJECT:
+        return {"ok": False, "error": "out_of_service_area"}
     rid = str(uuid.uuid4())
+    if verdict == geofence.PARTNER:
+        # handed to the partner; never enters the job board
+        REQUESTS[rid] = {
+            "id": rid, "ts": time.time(), "status": "referred", "partner": area.partner_id,
+            "service": body.service, "pickup": [body.pickup_lat, body.pickup_lng],
+            "phone": body.customer_phone
+        }
+        return REQUESTS[rid]
     miles = 0.0
     if body.drop_lat is not None and body.drop_lng is not None:
         miles = haversine_miles(body.pickup_lat, body.pickup_lng, body.drop_lat, body.drop_lng)
@@ -186,262 +317,135 @@ def create_request(body: RequestServiceReq):
         "miles": round(miles, 2), "price": price, "phone": body.customer_phone
     }
     JOBS[rid] = {"id": rid, "request_id": rid, "status": "open"}
+    _record_change(rid)
     # optional: notify listeners
-    asyncio.create_task(broadcast({"type": "job_opened", "job": JOBS[rid]}))
+    publish({"type": "job_opened", "job": JOBS[rid]})
     return REQUESTS[rid]
 
 @app.post("/providers/online")
 def provider_online(p: ProviderOnlineReq):
-    PROVIDERS[p.provider_id] = {
-        "id": p.provider_id, "vehicle": p.vehicle,
-        "lat": p.lat, "lng": p.lng, "online": True
-    }
+    with _PROVIDERS_LOCK:
+        PROVIDERS[p.provider_id] = {
+            "id": p.provider_id, "vehicle": p.vehicle,
+            "lat": p.lat, "lng": p.lng, "online": True
+        }
+        PROVIDER_LIVENESS.heartbeat(p.provider_id)
     return {"ok": True}
 
-@app.get("/jobs/available")
-def jobs_available(provider_id: str):
+@app.post("/providers/heartbeat")
+def provider_heartbeat(provider_id: str, lat: Optional[float] = None, lng: Optional[float] = None):
     prov = PROVIDERS.get(provider_id)
-    if not prov or not prov.get("online"):
-        return {"jobs": []}
-    # capability filter
-    def can_do(vehicle: VehicleClass, svc: ServiceType) -> bool:
-        if vehicle == VehicleClass.SERVICE_TRUCK and svc in (
-            ServiceType.REGULAR_TOW, ServiceType.ACCIDENT_TOW, ServiceType.MOTO_TOW
-        ):
-            return False
-        return True
-    capable = []
-    for j in JOBS.values():
-        if j["status"] != "open":
-            continue
-        req = REQUESTS[j["request_id"]]
-        if can_do(prov["vehicle"], req["service"]):
-            capable.append({
-                "id": j["id"], "service": req["service"],
-                "price": req["price"], "pickup": req["pickup"], "drop": req["drop"]
-            })
-    return {"jobs": capable}
-
-@app.post("/jobs/{job_id}/accept")
-def accept_job(job_id: str, provider_id: str):
-    job = JOBS.get(job_id)
-    if not job or job["status"] != "open":
-        return {"ok": False, "error": "unavailable"}
-    req = REQUESTS[job["request_id"]]
-    prov = PROVIDERS.get(provider_id)
-    if not prov or not prov.get("online"):
+    if not prov or not PROVIDER_LIVENESS.touch(provider_id):
         return {"ok": False, "error": "provider_offline"}
-    # capability check (service truck can't tow)
-    if prov["vehicle"] == VehicleClass.SERVICE_TRUCK and req["service"] in (
-        ServiceType.REGULAR_TOW, ServiceType.ACCIDENT_TOW, ServiceType.MOTO_TOW
-    ):
-        return {"ok": False, "error": "not_capable"}
-    job["status"] = "assigned"
-    job["provider_id"] = provider_id
-    req["status"] = "assigned"
-    asyncio.create_task(broadcast({"type": "job_assigned", "job": job, "request": req}))
-    return {"ok": True, "job": job, "request": req}
-
-@app.patch("/jobs/{job_id}/status")
-def update_job(job_id: str, status: str):
-    job = JOBS.get(job_id)
-    if not job:
-        return {"ok": False, "error": "not_found"}
-    job["status"] = status
-    REQUESTS[job["request_id"]]["status"] = status
-    asyncio.create_task(broadcast({"type": "job_status", "job_id": job_id, "status": status}))
+    if lat is not None and lng is not None:
+        prov["lat"], prov["lng"] = lat, lng
+    return {"ok": True, "ttl": PROVIDER_HEARTBEAT_TTL}
+
+@app.post("/providers/offline")
+def provider_offline(provider_id: str):
+    PROVIDER_LIVENESS.remove(provider_id)
+    PROVIDERS.pop(provider_id, None)
     return {"ok": True}
-# --- WebSocket endpoint (simple hello + echo) ---
-from fastapi import WebSocket, WebSocketDisconnect
-
-ACTIVE_SOCKETS = []
 
-@app.websocket("/ws")
-async def websocket_endpoint(ws: WebSocket):
-    await ws.accept()
-    ACTIVE_SOCKETS.append(ws)
-    try:
-        await ws.send_json({"type": "hello", "msg": "road-guard ws connected"})
-        while True:
-            # keep alive; echo any text messages
-            msg = await ws.receive_text()
-            await ws.send_json({"type": "echo", "msg": msg})
-    except WebSocketDisconnect:
-        pass
-    finally:
-        if ws in ACTIVE_SOCKETS:
-            ACTIVE_SOCKETS.remove(ws)
-
-# helper to push events to all connected clients
-async def broadcast(msg: dict):
-    dead = []
-    for s in ACTIVE_SOCKETS:
-        try:
-            await s.send_json(msg)
-        except Exception:
-            dead.append(s)
-    for s in dead:
-        if s in ACTIVE_SOCKETS:
-            ACTIVE_SOCKETS.remove(s)
-            # --- Pricing & helpers (no DB; all in-memory) ---
-from enum import Enum
-from math import radians, sin, cos, asin, sqrt
-from typing import Optional, Dict, Any
-from pydantic import BaseModel
-import time, uuid, asyncio
-
-APP_CUT = 0.20  # app+tax cut = 20%
-
-class VehicleClass(str, Enum):
-    FLATBED = "flatbed"
-    WHEEL_LIFT = "wheel_lift"
-    SERVICE_TRUCK = "service_truck"  # can't tow
-
-class ServiceType(str, Enum):
-    REGULAR_TOW = "regular_tow"
-    ACCIDENT_TOW = "accident_tow"
-    MOTO_TOW = "motorcycle_tow"
-    FLAT_TIRE_SEDAN = "flat_tire_sedan"
-    FLAT_TIRE_TRUCK = "flat_tire_truck"
-    FLAT_TIRE_DUALLY = "flat_tire_dually"
-    FLAT_TIRE_TRAILER_RV = "flat_tire_trailer_rv"
-    JUMPSTART = "jumpstart"
-    LOCKOUT = "lockout"
-    WINCH_OUT = "winch_out"
-
-def haversine_miles(lat1, lon1, lat2, lon2):
-    R = 3958.8  # miles
-    dlat = radians(lat2 - lat1); dlon = radians(lon2 - lon1)
-    a = sin(dlat/2)**2 + cos(radians(lat1))*cos(radians(lat2))*sin(dlon/2)**2
-    return 2 * R * asin(sqrt(a))
-
-def compute_price(svc: ServiceType, miles: float, within5mi: bool=False) -> Dict[str, Any]:
-    miles = max(0.0, miles)
-    total = 0.0
-    details = {}
-
-    if svc == ServiceType.REGULAR_TOW:
-        base, free, per_mile = 105, 7, 5
-        extra = max(0, miles - free)
-        total = base + extra * per_mile
-        details = {"base": base, "free_miles": free, "extra_miles": extra, "per_mile": per_mile}
-
-    elif svc == ServiceType.ACCIDENT_TOW:
-        base, free, per_mile = 295, 21, 5
-        extra = max(0, miles - free)
-        total = base + extra * per_mile
-        details = {"base": base, "free_miles": free, "extra_miles": extra, "per_mile": per_mile}
-
-    elif svc == ServiceType.MOTO_TOW:
-        base, free, per_mile = 185, 7, 4
-        extra = max(0, miles - free)
-        total = base + extra * per_mile
-        details = {"base": base, "free_miles": free, "extra_miles": extra, "per_mile": per_mile}
-
-    elif svc in [ServiceType.FLAT_TIRE_SEDAN, ServiceType.FLAT_TIRE_TRUCK,
-                 ServiceType.FLAT_TIRE_DUALLY, ServiceType.FLAT_TIRE_TRAILER_RV]:
-        mapping = {
-            ServiceType.FLAT_TIRE_SEDAN: 75,
-            ServiceType.FLAT_TIRE_TRUCK: 85,
-            ServiceType.FLAT_TIRE_DUALLY: 125,
-            ServiceType.FLAT_TIRE_TRAILER_RV: 220,
-        }
-        total = mapping[svc]
-
-    elif svc == ServiceType.JUMPSTART:
-        total = 65 * (0.9 if within5mi else 1.0)
-
-    elif svc == ServiceType.LOCKOUT:
-        total = 75 * (0.9 if within5mi else 1.0)
-
-    elif svc == ServiceType.WINCH_OUT:
-        total = 195  # per hour; MVP assume 1 hr minimum
-
-    app_cut = round(total * APP_CUT, 2)
-    provider_earnings = round(total - app_cut, 2)
-    return {"total": round(total, 2), "app_cut": app_cut, "provider": provider_earnings, "details": details}
-    # --- Pydantic payloads ---
-class QuoteReq(BaseModel):
-    service: ServiceType
-    pickup_lat: float
-    pickup_lng: float
-    drop_lat: Optional[float] = None
-    drop_lng: Optional[float] = None
-
-class RequestServiceReq(QuoteReq):
-    customer_phone: str
-
-class ProviderOnlineReq(BaseModel):
-    provider_id: str
-    vehicle: VehicleClass
-    lat: float
-    lng: float
-
-# --- In-memory stores (MVP) ---
-REQUESTS: Dict[str, Dict] = {}
-PROVIDERS: Dict[str, Dict] = {}
-JOBS: Dict[str, Dict] = {}
-# --- Endpoints ---
-
-@app.post("/quote")
-def quote(body: QuoteReq):
-    miles = 0.0
-    if body.drop_lat is not None and body.drop_lng is not None:
-        miles = haversine_miles(body.pickup_lat, body.pickup_lng, body.drop_lat, body.drop_lng)
-    within5 = miles <= 5.0
-    price = compute_price(body.service, miles, within5mi=within5)
-    return {"miles": round(miles, 2), **price}
-
-@app.post("/requests")
-def create_request(body: RequestServiceReq):
-    rid = str(uuid.uuid4())
-    miles = 0.0
-    if body.drop_lat is not None and body.drop_lng is not None:
-        miles = haversine_miles(body.pickup_lat, body.pickup_lng, body.drop_lat, body.drop_lng)
-    within5 = miles <= 5.0
-    price = compute_price(body.service, miles, within5mi=within5)
-    REQUESTS[rid] = {
-        "id": rid, "ts": time.time(), "status": "open",
-        "service": body.service, "pickup": [body.pickup_lat, body.pickup_lng],
-        "drop": [body.drop_lat, body.drop_lng] if body.drop_lat is not None and body.drop_lng is not None else None,
-        "miles": round(miles, 2), "price": price, "phone": body.customer_phone
+def can_do(vehicle: VehicleClass, svc: ServiceType) -> bool:
+    # capability filter: service trucks can't tow
+    if vehicle == VehicleClass.SERVICE_TRUCK and svc in (
+        ServiceType.REGULAR_TOW, ServiceType.ACCIDENT_TOW, ServiceType.MOTO_TOW
+    ):
+        return False
+    return True
+
+def _job_view(j):
+    req = REQUESTS[j["request_id"]]
+    return {
+        "id": j["id"], "service": req["service"],
+        "price": req["price"], "pickup": req["pickup"], "drop": req["drop"]
     }
-    JOBS[rid] = {"id": rid, "request_id": rid, "status": "open"}
-    # optional: notify listeners
-    asyncio.create_task(broadcast({"type": "job_opened", "job": JOBS[rid]}))
-    return REQUESTS[rid]
 
-@app.post("/providers/online")
-def provider_online(p: ProviderOnlineReq):
-    PROVIDERS[p.provider_id] = {
-        "id": p.provider_id, "vehicle": p.vehicle,
-        "lat": p.lat, "lng": p.lng, "online": True
-    }
-    return {"ok": True}
+def _available_delta(vehicle, changed):
+    jobs, removed = [], []
+    for job_id in changed:
+        j = JOBS.get(job_id)
+        if not j or not can_do(vehicle, REQUESTS[j["request_id"]]["service"]):
+            continue
+        if j["status"] == "open":
+            jobs.append(_job_view(j))
+        else:
+            removed.append(job_id)
+    return jobs, removed
+
+def _parse_etag(value: Optional[str]) -> Optional[int]:
+    if not value:
+        return None
+    tag = value.split(",")[0].strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    try:
+        return int(tag.strip('"'))
+    except ValueError:
+        return None
+
+def _available_full(vehicle, since):
+    with _CHANGE_LOCK:
+        seq = CHANGE_SEQ
+    capable = [_job_view(j) for j in list(JOBS.values())
+               if j["status"] == "open" and can_do(vehicle, REQUESTS[j["request_id"]]["service"])]
+    body = {"jobs": capable, "cursor": seq}
+    if since is not None:
+        body["reset"] = True
+    return Response(codec.dumps(body), media_type="application/json", headers={"ETag": f'"{seq}"'})
+
+def _available_since(vehicle, base, since):
+    """
+    Response for changes after `base`, or (None, seq) when nothing relevant changed up
+    to seq. Runs in the threadpool: the delta and full-list scans stay off the event loop.
+    """
+    changed, seq = _changes_since(base)
+    if changed is None:
+        # cursor too old (or from before a restart): fall back to a full list
+        return _available_full(vehicle, since), seq
+    jobs, removed = _available_delta(vehicle, changed)
+    if not (jobs or removed):
+        return None, seq
+    if since is None:
+        return _available_full(vehicle, since), seq  # plain poll with a stale ETag
+    body = {"jobs": jobs, "removed": removed, "cursor": seq, "delta": True}
+    return Response(codec.dumps(body), media_type="application/json", headers={"ETag": f'"{seq}"'}), seq
 
 @app.get("/jobs/available")
-def jobs_available(provider_id: str):
+async def jobs_available(request: Request, provider_id: str, since: Optional[int] = None, wait: float = 0):
+    """
+    Open jobs this provider can do.
+    ?since=<cursor> returns only jobs added/updated ("jobs") or no longer open ("removed")
+    after the cursor; If-None-Match with the last ETag gets a 304 when nothing relevant
+    changed; wait=<seconds> holds the request until a relevant change (long poll).
+    Only the long-poll wait is async; the job scans run in the threadpool.
+    """
+    global _CHANGED
     prov = PROVIDERS.get(provider_id)
     if not prov or not prov.get("online"):
         return {"jobs": []}
-    # capability filter
-    def can_do(vehicle: VehicleClass, svc: ServiceType) -> bool:
-        if vehicle == VehicleClass.SERVICE_TRUCK and svc in (
-            ServiceType.REGULAR_TOW, ServiceType.ACCIDENT_TOW, ServiceType.MOTO_TOW
-        ):
-            return False
-        return True
-    capable = []
-    for j in JOBS.values():
-        if j["status"] != "open":
-            continue
-        req = REQUESTS[j["request_id"]]
-        if can_do(prov["vehicle"], req["service"]):
-            capable.append({
-                "id": j["id"], "service": req["service"],
-                "price": req["price"], "pickup": req["pickup"], "drop": req["drop"]
-            })
-    return {"jobs": capable}
+    vehicle = prov["vehicle"]
+    base = since if since is not None else _parse_etag(request.headers.get("if-none-match"))
+    if base is None:
+        return await run_in_threadpool(_available_full, vehicle, since)
+    deadline = time.monotonic() + min(max(wait, 0.0), LONG_POLL_MAX)
+    while True:
+        response, seq = await run_in_threadpool(_available_since, vehicle, base, since)
+        if response is not None:
+            return response
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return Response(status_code=304, headers={"ETag": f'"{seq}"'})
+        if _CHANGED is None:
+            _CHANGED = asyncio.Event()
+        # a change recorded while the scan ran has already fired its wake-up; don't wait for it
+        if CHANGE_SEQ == seq:
+            try:
+                await asyncio.wait_for(_CHANGED.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+        base = seq  # nothing up to seq was relevant
 
 @app.post("/jobs/{job_id}/accept")
 def accept_job(job_id: str, provider_id: str):
@@ -460,7 +464,8 @@ def accept_job(job_id: str, provider_id: str):
     job["status"] = "assigned"
     job["provider_id"] = provider_id
     req["status"] = "assigned"
-    asyncio.create_task(broadcast({"type": "job_assigned", "job": job, "request": req}))
+    _record_change(job_id)
+    publish({"type": "job_assigned", "job": job, "request": req})
     return {"ok": True, "job": job, "request": req}
 
 @app.patch("/jobs/{job_id}/status")
@@ -470,6 +475,6 @@ def update_job(job_id: str, status: str):
         return {"ok": False, "error": "not_found"}
     job["status"] = status
     REQUESTS[job["request_id"]]["status"] = status
-    asyncio.create_task(broadcast({"type": "job_status", "job_id": job_id, "status": status}))
+    _record_change(job_id)
+    publish({"type": "job_status", "job_id": job_id, "status": status})
     return {"ok": True}
-    
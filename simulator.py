@@ -0,0 +1,275 @@
+"""Deterministic discrete-event dispatch simulator for policy evaluation.
+Replays a day of job arrivals and driver movements against the real matching rules
+in dispatch.py (`select_candidates`, `radius_schedule`, `rank_score`) on a virtual
+clock: dispatch backoff, travel and service time are heap events, never real sleeps,
+so a 24h metro day runs in seconds on one core. `sweep` fans parameter sets out over
+a process pool. Usage:
+    python -m app.simulator --jobs 3000 --drivers 250 --seed 7
+    python -m app.simulator --day recorded_day.json --sweep
+A recorded day is JSON with:
+    drivers: [{id, lat, lon, vehicle, rating?, shift_start?, shift_end?}]
+    jobs:    [{t, lat, lon, service_type, dropoff_lat?, dropoff_lon?}]
+    moves:   [{t, driver_id, lat, lon}]            (optional)
+where t / shift_* are seconds since the start of the day.
+"""
+
+import argparse
+import heapq
+import json
+import math
+import random
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from .dispatch import (haversine_miles, radius_schedule, select_candidates, INITIAL_RADIUS_MILES,
+                       RADIUS_GROWTH, MAX_ATTEMPTS, BACKOFF_SECONDS, NO_TOW_VEHICLES, TOW_SERVICES)
+
+DAY_SECONDS = 24 * 3600
+EPOCH = datetime(2024, 1, 1)  # virtual clock origin; only differences matter
+
+SPEED_MPH = 30.0
+HOOKUP_MINUTES = 15.0
+ROADSIDE_MINUTES = 20.0
+
+# relative demand by hour of day (synthetic days)
+HOURLY_DEMAND = [0.3, 0.2, 0.2, 0.2, 0.3, 0.5, 0.9, 1.4, 1.5, 1.1, 1.0, 1.0,
+                 1.1, 1.0, 1.0, 1.2, 1.5, 1.7, 1.4, 1.0, 0.8, 0.7, 0.5, 0.4]
+SERVICE_MIX = [("regular_tow", 0.35), ("accident_tow", 0.10), ("motorcycle_tow", 0.05),
+               ("jumpstart", 0.20), ("lockout", 0.15), ("flat_tire_sedan", 0.15)]
+VEHICLE_MIX = [("flatbed", 0.45), ("wheel_lift", 0.25), ("service_truck", 0.30)]
+
+DEFAULT_POLICY = {
+    "initial_radius": INITIAL_RADIUS_MILES,
+    "growth": RADIUS_GROWTH,
+    "max_attempts": MAX_ATTEMPTS,
+    "backoff_seconds": BACKOFF_SECONDS,
+    "no_tow_vehicles": sorted(NO_TOW_VEHICLES),
+}
+
+class SimVehicle:
+    __slots__ = ("id", "type")
+
+    def __init__(self, id, type):
+        self.id = id
+        self.type = type
+
+class SimDriver:
+    """Stand-in for models.Driver carrying the columns the matching rules read."""
+    __slots__ = ("id", "current_lat", "current_lon", "rating", "rating_recent", "rating_count",
+                 "last_assigned_at", "is_online", "busy", "vehicle")
+
+    def __init__(self, id, lat, lon, vehicle, rating=5.0):
+        self.id = id
+        self.current_lat = lat
+        self.current_lon = lon
+        self.rating = rating
+        self.rating_recent = rating
+        self.rating_count = 0
+        self.last_assigned_at = None
+        self.is_online = False
+        self.busy = False
+        self.vehicle = vehicle
+
+def _offset(lat, lon, miles, bearing):
+    # small-distance offset in miles along a bearing (radians)
+    dlat = miles * math.cos(bearing) / 69.0
+    dlon = miles * math.sin(bearing) / (69.0 * math.cos(math.radians(lat)))
+    return lat + dlat, lon + dlon
+
+def _pick(rng, mix):
+    r = rng.random() * sum(w for _, w in mix)
+    for value, w in mix:
+        r -= w
+        if r <= 0:
+            return value
+    return mix[-1][0]
+
+def synthetic_day(seed=0, n_jobs=3000, n_drivers=250, center=(32.7767, -96.7970), radius_miles=25.0):
+    """Generate a reproducible metro day (Dallas-sized by default) as a recorded-day dict."""
+    rng = random.Random(seed)
+    lat0, lon0 = center
+
+    def point():
+        # denser toward the core
+        return _offset(lat0, lon0, radius_miles * rng.random() ** 1.5, rng.uniform(0, 2 * math.pi))
+
+    drivers = []
+    for i in range(n_drivers):
+        lat, lon = point()
+        start = rng.choice([0, 6, 6, 7, 8, 14, 15, 16, 22]) * 3600 + rng.randint(0, 3599)
+        drivers.append({"id": f"d{i}", "lat": lat, "lon": lon, "vehicle": _pick(rng, VEHICLE_MIX),
+                        "rating": round(rng.uniform(3.8, 5.0), 2),
+                        "shift_start": start, "shift_end": start + rng.randint(6, 10) * 3600})
+
+    # non-homogeneous Poisson arrivals by thinning against the hourly curve
+    peak = max(HOURLY_DEMAND)
+    mean_rate = sum(HOURLY_DEMAND) / len(HOURLY_DEMAND)
+    rate = n_jobs / DAY_SECONDS * peak / mean_rate
+    jobs, t = [], 0.0
+    while True:
+        t += rng.expovariate(rate)
+        if t >= DAY_SECONDS:
+            break
+        if rng.random() > HOURLY_DEMAND[int(t // 3600)] / peak:
+            continue
+        lat, lon = point()
+        svc = _pick(rng, SERVICE_MIX)
+        job = {"t": round(t, 1), "lat": lat, "lon": lon, "service_type": svc}
+        if svc in TOW_SERVICES:
+            job["dropoff_lat"], job["dropoff_lon"] = _offset(lat, lon, rng.uniform(2, 20), rng.uniform(0, 2 * math.pi))
+        jobs.append(job)
+
+    # drivers reposition toward the core every ~45 minutes while waiting
+    moves = []
+    for d in drivers:
+        t = d["shift_start"] + rng.expovariate(1 / 2700)
+        while t < min(d["shift_end"], DAY_SECONDS):
+            lat, lon = point()
+            moves.append({"t": round(t, 1), "driver_id": d["id"], "lat": lat, "lon": lon})
+            t += rng.expovariate(1 / 2700)
+    return {"drivers": drivers, "jobs": jobs, "moves": moves}
+
+# event kinds, ordered so that at equal times drivers come online / free up before matching
+_ONLINE, _FREE, _MOVE, _OFFLINE, _ARRIVAL, _ATTEMPT = range(6)
+
+def simulate(day, policy=None):
+    """Run one day under a policy (see DEFAULT_POLICY) and return summary metrics."""
+    policy = {**DEFAULT_POLICY, **(policy or {})}
+    radii = radius_schedule(policy["initial_radius"], policy["growth"], policy["max_attempts"])
+    backoff = policy["backoff_seconds"]
+    no_tow = frozenset(policy["no_tow_vehicles"])
+
+    drivers = {}
+    events = []
+    seq = 0
+
+    def push(t, kind, data):
+        nonlocal seq
+        heapq.heappush(events, (t, kind, seq, data))
+        seq += 1
+
+    for d in day["drivers"]:
+        drv = SimDriver(d["id"], d["lat"], d["lon"], SimVehicle(f"v-{d['id']}", d["vehicle"]),
+                        d.get("rating", 5.0))
+        drivers[drv.id] = drv
+        push(d.get("shift_start", 0), _ONLINE, drv.id)
+        if d.get("shift_end") is not None:
+            push(d["shift_end"], _OFFLINE, drv.id)
+    for i, job in enumerate(day["jobs"]):
+        push(job["t"], _ARRIVAL, i)
+    for m in day.get("moves", ()):
+        push(m["t"], _MOVE, m)
+
+    available = {}  # driver id -> SimDriver, online and idle (insertion ordered like a DB scan)
+    vehicle_for = lambda d: d.vehicle
+    filled = unserviced = 0
+    pickup_miles = wait_seconds = 0.0
+    attempts_used = [0] * len(radii)
+
+    while events:
+        t, kind, _, data = heapq.heappop(events)
+        if kind == _ONLINE:
+            drv = drivers[data]
+            drv.is_online = True
+            if not drv.busy:
+                available[data] = drv
+        elif kind == _OFFLINE:
+            drivers[data].is_online = False
+            available.pop(data, None)
+        elif kind == _MOVE:
+            drv = drivers[data["driver_id"]]
+            if not drv.busy:
+                drv.current_lat, drv.current_lon = data["lat"], data["lon"]
+        elif kind == _FREE:
+            drv_id, lat, lon = data
+            drv = drivers[drv_id]
+            drv.busy = False
+            drv.current_lat, drv.current_lon = lat, lon
+            if drv.is_online:
+                available[drv_id] = drv
+        elif kind == _ARRIVAL:
+            push(t, _ATTEMPT, (data, 0))
+        else:
+            job_idx, attempt = data
+            job = day["jobs"][job_idx]
+            now = EPOCH + timedelta(seconds=t)
+            candidates = select_candidates(list(available.values()), vehicle_for, job["lat"], job["lon"],
+                                           job["service_type"], radii[attempt], now, no_tow)
+            if candidates:
+                drv, _, dist = candidates[0]
+                del available[drv.id]
+                drv.busy = True
+                drv.last_assigned_at = now
+                filled += 1
+                pickup_miles += dist
+                wait_seconds += t - job["t"]
+                attempts_used[attempt] += 1
+                if job["service_type"] in TOW_SERVICES and job.get("dropoff_lat") is not None:
+                    end_lat, end_lon = job["dropoff_lat"], job["dropoff_lon"]
+                    tow = haversine_miles(job["lat"], job["lon"], end_lat, end_lon)
+                    on_site = HOOKUP_MINUTES * 60 + tow / SPEED_MPH * 3600
+                else:
+                    end_lat, end_lon = job["lat"], job["lon"]
+                    on_site = ROADSIDE_MINUTES * 60
+                push(t + dist / SPEED_MPH * 3600 + on_site, _FREE, (drv.id, end_lat, end_lon))
+            elif attempt + 1 < len(radii):
+                push(t + backoff, _ATTEMPT, (job_idx, attempt + 1))
+            else:
+                unserviced += 1
+
+    total = len(day["jobs"])
+    return {
+        "policy": policy,
+        "jobs": total,
+        "filled": filled,
+        "unserviced": unserviced,
+        "fill_rate": round(filled / total, 4) if total else 0.0,
+        "pickup_miles": round(pickup_miles, 1),
+        "avg_pickup_miles": round(pickup_miles / filled, 2) if filled else 0.0,
+        "avg_wait_seconds": round(wait_seconds / filled, 2) if filled else 0.0,
+        "filled_by_attempt": attempts_used,
+    }
+
+def _simulate_args(args):
+    return simulate(*args)
+
+def sweep(day, policies, workers=None):
+    """Evaluate several policies in parallel (one process per run); results keep input order."""
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_simulate_args, [(day, p) for p in policies]))
+
+def default_grid():
+    grid = []
+    for initial in (2.0, 3.0, 5.0):
+        for growth in (1.5, 2.0):
+            for attempts in (3, 4, 6):
+                for backoff in (1.0, 30.0):
+                    grid.append({"initial_radius": initial, "growth": growth,
+                                 "max_attempts": attempts, "backoff_seconds": backoff})
+    return grid
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a dispatch day on a virtual clock")
+    parser.add_argument("--day", help="recorded day JSON (default: synthetic)")
+    parser.add_argument("--jobs", type=int, default=3000)
+    parser.add_argument("--drivers", type=int, default=250)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sweep", action="store_true", help="run default_grid() over a process pool")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    if args.day:
+        with open(args.day) as f:
+            day = json.load(f)
+    else:
+        day = synthetic_day(seed=args.seed, n_jobs=args.jobs, n_drivers=args.drivers)
+
+    results = sweep(day, default_grid(), args.workers) if args.sweep else [simulate(day)]
+    print(f"{'radius':>6} {'growth':>6} {'tries':>5} {'backoff':>7} {'fill':>7} {'unsvc':>6} {'pickup_mi':>10} {'avg_mi':>7}")
+    for r in results:
+        p = r["policy"]
+        print(f"{p['initial_radius']:>6} {p['growth']:>6} {p['max_attempts']:>5} {p['backoff_seconds']:>7} "
+              f"{r['fill_rate']:>7.2%} {r['unserviced']:>6} {r['pickup_miles']:>10} {r['avg_pickup_miles']:>7}")
+
+if __name__ == "__main__":
+    main()